@@ -0,0 +1,195 @@
+import argparse
+import gc
+import inspect
+import json
+import platform
+import sys
+import time
+from functools import partial
+import tracemalloc
+import numpy as np
+import testmanager
+from typing import Any, Callable, Dict, List, Tuple
+from src.kdtree import KdTree
+from src.Quadtree import QuadTree
+from src.planner import QueryPlanner
+from src.rangetree import RangeTree
+from src.morton import LinearQuadTree
+
+ENGINES: Dict[str, Callable[[np.ndarray], Any]] = {
+    "kdtree": KdTree,
+    "quadtree": QuadTree,
+    "planner": QueryPlanner,
+    "rangetree": RangeTree,
+    "linearquadtree": LinearQuadTree,
+}
+# Silniki statyczne bez parametru dtype (pełna precyzja współrzędnych).
+FULL_PRECISION = {"planner", "rangetree", "linearquadtree"}
+SIZES = [1000, 10000, 100000]
+SELECTIVITIES = [0.0001, 0.01, 0.1]
+
+# Metryki porównywane z bazą: czasy i zużycie pamięci nie mogą wzrosnąć, a
+# przepustowość spaść o więcej niż zadana tolerancja.
+TIMES = ["build_median", "query_median", "query_p95", "count_median", "count_p95"]
+RATES = ["throughput"]
+BYTES = ["build_peak_bytes", "index_bytes"]
+
+
+def generators() -> List[Tuple[str, Callable]]:
+    return [
+        (name, obj) for name, obj in inspect.getmembers(testmanager, inspect.isfunction)
+        if name.find("test") != -1 and obj.__module__ == testmanager.__name__
+    ]
+
+
+def timed(fn: Callable[[], Any], repeats: int) -> np.ndarray:
+    times = np.empty(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times[i] = time.perf_counter() - start
+    return times
+
+
+def peak_memory(fn: Callable[[], Any]) -> int:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_case(
+    engine: Callable[[np.ndarray], Any],
+    points: np.ndarray,
+    rects: np.ndarray,
+    repeats: int,
+) -> Dict[str, float]:
+    build = timed(lambda: engine(points), repeats)
+    memory = peak_memory(lambda: engine(points))
+    tree = engine(points)
+
+    # Opóźnienie i przepustowość mierzą tę samą operację (query_many);
+    # count_many, które pomija sprawdzanie pokrytych poddrzew, osobno.
+    latency = np.array([timed(lambda: tree.query_many(rect[None]), 1)[0] for rect in rects])
+    count_latency = np.array([timed(lambda: tree.count_many(rect[None]), 1)[0] for rect in rects])
+    batch = timed(lambda: tree.query_many(rects), repeats)
+    counts = tree.count_many(rects)
+    return {
+        "build_median": float(np.median(build)),
+        "build_p95": float(np.percentile(build, 95)),
+        "build_peak_bytes": memory,
+        "index_bytes": tree.nbytes(),
+        "query_median": float(np.median(latency)),
+        "query_p95": float(np.percentile(latency, 95)),
+        "count_median": float(np.median(count_latency)),
+        "count_p95": float(np.percentile(count_latency, 95)),
+        "throughput": float(len(rects) / np.median(batch)),
+        "hits_mean": float(counts.mean()) if len(counts) > 0 else 0.0,
+    }
+
+
+def engines(args: argparse.Namespace) -> Dict[str, Callable[[np.ndarray], Any]]:
+    # --leaf-sizes zastępuje kdtree wariantami o podanych rozmiarach liści,
+    # a --dtypes dodaje do każdego drzewa warianty o zmniejszonej precyzji.
+    selected = {name: ENGINES[name] for name in args.engines}
+    if args.leaf_sizes and "kdtree" in selected:
+        del selected["kdtree"]
+        for leaf_size in args.leaf_sizes:
+            selected[f"kdtree-leaf{leaf_size}"] = partial(KdTree, leaf_size=leaf_size)
+    for name, build in list(selected.items()):
+        if name not in FULL_PRECISION:
+            for dtype in args.dtypes or []:
+                selected[f"{name}-{dtype}"] = partial(build, dtype=dtype)
+    return selected
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    results = {}
+    cases = engines(args)
+    selected = [(name, fn) for name, fn in generators() if not args.generators or name in args.generators]
+    for name, generator in selected:
+        for size in args.sizes:
+            points, _ = generator(size, seed=args.seed)
+            points = np.asarray(points, dtype=np.float64)
+            for selectivity in args.selectivities:
+                # Dla danych skupionych faktyczny odsetek trafień odbiega od
+                # selectivity - raportowany jest osobno (hits_mean).
+                rects = testmanager.random_rectangles(points, args.queries, selectivity, args.seed)
+                for engine, build in cases.items():
+                    key = f"{name}/{size}/{selectivity}/{engine}"
+                    print(f"Running {key}...", flush=True)
+                    results[key] = run_case(build, points, rects, args.repeats)
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "seed": args.seed,
+            "repeats": args.repeats,
+            "queries": args.queries,
+            "leaf_sizes": args.leaf_sizes,
+            "dtypes": args.dtypes,
+        },
+        "results": results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    regressions = []
+    for key, metrics in current["results"].items():
+        reference = baseline["results"].get(key)
+        if reference is None:
+            continue
+        # Metryki nieobecne w starszej bazie są pomijane.
+        for metric in TIMES:
+            if metric in reference and metrics[metric] > reference[metric] * tolerance:
+                regressions.append(f"{key} {metric}: {reference[metric]:.6f}s -> {metrics[metric]:.6f}s")
+        for metric in RATES:
+            if metric in reference and metrics[metric] * tolerance < reference[metric]:
+                regressions.append(f"{key} {metric}: {reference[metric]:.1f}/s -> {metrics[metric]:.1f}/s")
+        for metric in BYTES:
+            if metric in reference and metrics[metric] > reference[metric] * tolerance:
+                regressions.append(f"{key} {metric}: {reference[metric]} B -> {metrics[metric]} B")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark KdTree, QuadTree and RangeTree on the testmanager distributions.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--selectivities", type=float, nargs="+", default=SELECTIVITIES)
+    parser.add_argument("--engines", nargs="+", choices=sorted(ENGINES), default=sorted(ENGINES))
+    parser.add_argument("--generators", nargs="+", default=None)
+    parser.add_argument("--leaf-sizes", type=int, nargs="+", default=None)
+    parser.add_argument("--dtypes", nargs="+", default=None)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    args = parser.parse_args()
+
+    current = run(args)
+    with open(args.output, "w") as f:
+        json.dump(current, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(current, baseline, args.tolerance)
+    if regressions:
+        print(f"\033[91m✘ {len(regressions)} regression(s) against {args.baseline}:\033[0m")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"\033[92m✔ No regressions against {args.baseline}.\033[0m")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,30 +1,231 @@
+import os
+import shutil
+import sys
 import numpy as np
-from typing import Optional, Generator, Tuple, List, Dict
+from typing import Any, Optional, Generator, Tuple, List, Dict
 from .rectangle import Rectangle
+from .batch import as_rectangles, csr_order, from_rectangle
+from .traversal import expand_ranges, quad_count, quad_disk, quad_range
+from .duplicates import group_duplicates, regroup_rows
+from .dynamic import DynamicTree
+from .polygon import Polygon, quad_polygon
+from .parallel import run_tasks
+from .external import (
+    Chunks, IndexWriter, Source, bounds, bucket_size, copy_points, cumulative_counts,
+    spill_directory, write_manifest,
+)
 
 
 class QuadTreeNode:
+    __slots__ = ["boundary", "points", "counts", "indices", "children", "count"]
+
     def __init__(
         self,
         boundary: Rectangle,
-        point_counts: Optional[Dict[Tuple[float, float], int]] = None,
+        points: Optional[np.ndarray] = None,
+        counts: Optional[np.ndarray] = None,
+        indices: Optional[np.ndarray] = None,
         children: Optional[List["QuadTreeNode"]] = None
     ):
         self.boundary = boundary
-        self.point_counts = point_counts
+        # Liść przechowuje unikalne punkty, ich krotności oraz numer pierwszego
+        # wiersza tablicy wejściowej, w którym dany punkt występuje.
+        self.points = points
+        self.counts = counts
+        self.indices = indices
         self.children = children if children is not None else []
 
-        if self.point_counts is not None:
-            self.count = sum(self.point_counts.values())
+        if self.points is not None:
+            self.count = int(self.counts.sum())
         else:
             self.count = sum(child.count for child in self.children)
 
+    @property
+    def point_counts(self) -> Optional[Dict[Tuple[float, float], int]]:
+        if self.points is None:
+            return None
+        return {(p[0], p[1]): c for p, c in zip(self.points, self.counts)}
+
     def is_leaf(self) -> bool:
-        return self.point_counts is not None
+        return self.points is not None
+
+
+def split_points(points: np.ndarray, low: np.ndarray, high: np.ndarray) -> np.ndarray:
+    # Numer ćwiartki (0 - lewa dolna, 1 - prawa dolna, 2 - lewa górna,
+    # 3 - prawa górna) względem środka obwiedni. Gdy środek zaokrągla się do
+    # maksimum (sąsiednie liczby zmiennoprzecinkowe), podział idzie po minimum,
+    # więc węzeł z różnymi punktami zawsze dzieli się na co najmniej dwie części.
+    # Współrzędne całkowite są sumowane w float64, bez przepełnienia.
+    if low.dtype.kind in "iu":
+        low, high = low.astype(np.float64), high.astype(np.float64)
+    mid = (low + high) / 2
+    mid = np.where(mid >= high, low, mid)
+    right, top = points[:, 0] > mid[..., 0], points[:, 1] > mid[..., 1]
+    return right.astype(np.int8) + 2 * top.astype(np.int8)
+
+
+def quad_index_dtype(n: int) -> type:
+    return np.int32 if 2 * n < np.iinfo(np.int32).max else np.int64
+
+
+def build_quad(
+    points: np.ndarray, max_capacity: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # Budowa bez obiektów węzłów, wszystkie węzły jednego poziomu naraz.
+    # Węzeł to przedział [lo, hi) permutacji order; podział stabilnie
+    # przestawia punkty w obrębie przedziału w kolejności ćwiartek, więc na
+    # końcu order to dokładnie punkty liści w kolejności preorder. Węzły
+    # powstają poziomami (wszerz) i na końcu są przenumerowane na preorder.
+    n = len(points)
+    order = np.arange(n)
+    if n == 0:
+        empty = np.zeros(0, dtype=np.int32)
+        return order, np.empty((0, 4), dtype=points.dtype), np.empty((0, 4), dtype=np.int32), empty, empty
+
+    levels = []
+    lo, hi = np.zeros(1, dtype=np.int64), np.full(1, n, dtype=np.int64)
+    parent, slot = np.full(1, -1, dtype=np.int64), np.zeros(1, dtype=np.int64)
+    first_id = 0
+    while len(lo) > 0:
+        sizes = hi - lo
+        seg, pos = expand_ranges(np.arange(len(lo)), lo, hi)
+        p = points[order[pos]]
+        starts = np.cumsum(sizes) - sizes
+        low, high = np.minimum.reduceat(p, starts), np.maximum.reduceat(p, starts)
+        levels.append((lo, hi, parent, slot, np.hstack([low, high])))
+
+        # Węzeł z samymi identycznymi punktami zostaje liściem niezależnie
+        # od max_capacity - podział nic by nie zmienił.
+        split = np.flatnonzero((sizes > max_capacity) & np.any(low != high, axis=1))
+        inner = np.isin(seg, split)
+        seg, pos = seg[inner], pos[inner]
+        key = np.searchsorted(split, seg) * 4 + split_points(p[inner], low[seg], high[seg])
+        order[pos] = order[pos][np.argsort(key, kind="stable")]
+
+        quarter = np.bincount(key, minlength=4 * len(split)).reshape(-1, 4)
+        first = lo[split][:, None] + np.cumsum(quarter, axis=1) - quarter
+        used = quarter > 0
+        parent = np.repeat(first_id + split, used.sum(axis=1))
+        slot = (np.cumsum(used, axis=1) - 1)[used]
+        lo, hi = first[used], (first + quarter)[used]
+        first_id += len(sizes)
+
+    lo, hi, parent, slot, bounds = (np.concatenate(values) for values in zip(*levels))
+    level_ends = np.cumsum([len(level[0]) for level in levels]).tolist()
+    spans = list(zip(level_ends[:-1], level_ends[1:]))
+
+    # Numer preorder dziecka: numer rodzica + 1 + rozmiary poddrzew
+    # wcześniejszych rodzeństw (rodzeństwo leży obok siebie na poziomie).
+    size = np.ones(len(lo), dtype=np.int64)
+    for a, b in reversed(spans):
+        np.add.at(size, parent[a:b], size[a:b])
+    pre = np.zeros(len(lo), dtype=np.int64)
+    for a, b in spans:
+        before = np.cumsum(size[a:b]) - size[a:b]
+        siblings = np.searchsorted(parent[a:b], parent[a:b])
+        pre[a:b] = pre[parent[a:b]] + 1 + before - before[siblings]
 
+    # Indeksy węzłów i pozycji jak w build_layout: int32, o ile się mieszczą
+    # (węzłów jest mniej niż 2n, bo każdy podział daje co najmniej dwoje dzieci).
+    index_dtype = quad_index_dtype(n)
+    children = np.full((len(lo), 4), -1, dtype=index_dtype)
+    children[pre[parent[1:]], slot[1:]] = pre[1:]
+    out_bounds = np.empty_like(bounds)
+    out_lo, out_hi = np.empty(len(lo), dtype=index_dtype), np.empty(len(hi), dtype=index_dtype)
+    out_bounds[pre], out_lo[pre], out_hi[pre] = bounds, lo, hi
+    return order, out_bounds, children, out_lo, out_hi
 
-class QuadTree:
-    def __init__(self, points: np.ndarray, max_capacity: int = 4):
+
+def _quad_segment(
+    arrays: Dict[str, np.ndarray], start: int, stop: int, max_capacity: int
+) -> Tuple[np.ndarray, ...]:
+    ids = arrays["ids"][start:stop]
+    tree = QuadTree.__new__(QuadTree)
+    tree.max_capacity = max_capacity
+    tree._layout(arrays["points"][ids], arrays["weights"][ids], arrays["rows"][ids])
+    return tree.bounds, tree.children, tree.lo, tree.hi, tree.coords, np.diff(tree.cum_counts), tree.rows
+
+
+# Szacowane zużycie pamięci budowy w pamięci na jeden punkt (bajty).
+BUILD_BYTES_PER_POINT = 250
+
+
+def _external_quad(
+    source: Chunks,
+    bbox: np.ndarray,
+    max_capacity: int,
+    writer: IndexWriter,
+    spill: str,
+    bucket: int,
+    chunk_size: int,
+) -> Tuple[int, int, int]:
+    index, offset = writer.sizes["part0_bounds"], writer.sizes["coords"]
+    if source.count <= bucket:
+        coords, rows = source.load()
+        unique_points, counts, first_rows, row_order = group_duplicates(coords)
+        tree = QuadTree.__new__(QuadTree)
+        tree.max_capacity = max_capacity
+        tree._layout(unique_points, counts, first_rows)
+        writer.append("part0_bounds", tree.bounds)
+        writer.append("part0_children", np.where(tree.children >= 0, tree.children.astype(np.int64) + index, -1))
+        writer.append("part0_lo", tree.lo.astype(np.int64) + offset)
+        writer.append("part0_hi", tree.hi.astype(np.int64) + offset)
+        counts = np.diff(tree.cum_counts)
+        writer.append("coords", tree.coords)
+        writer.append("counts", counts)
+        writer.append("rows", rows[tree.rows])
+        writer.append("row_order", rows[regroup_rows(row_order, tree.rows, counts)])
+        return index, offset, offset + len(tree.coords)
+
+    writer.append("part0_bounds", bbox)
+    writer.append("part0_children", np.full(4, -1))
+    writer.append("part0_lo", [offset])
+    writer.append("part0_hi", [offset])
+    xmin, ymin, xmax, ymax = bbox.tolist()
+
+    # Wszystkie punkty węzła są identyczne: liść z jednym unikalnym punktem.
+    if xmin == xmax and ymin == ymax:
+        first_row = -1
+        for _, rows in source.chunks(chunk_size):
+            writer.append("row_order", rows)
+            first_row = int(rows[0]) if first_row < 0 else first_row
+        writer.append("coords", np.array([[xmin, ymin]]).astype(source.coord_dtype))
+        writer.append("counts", [source.count])
+        writer.append("rows", [first_row])
+        writer.patch("part0_hi", index, offset + 1)
+        return index, offset, offset + 1
+
+    # Podział jak w build_quad; obwiednie ćwiartek są zbierane w tym samym
+    # przebiegu, bo wyznaczają podział kolejnego poziomu.
+    quadrants = [Chunks(source.coord_dtype, os.path.join(spill, f"{index}-{j}.bin")) for j in range(4)]
+    low, high = np.full((4, 2), np.inf), np.full((4, 2), -np.inf)
+    for coords, rows in source.chunks(chunk_size):
+        side = split_points(coords, bbox[:2], bbox[2:])
+        for j in range(4):
+            mask = side == j
+            if np.any(mask):
+                quadrants[j].append(coords[mask], rows[mask])
+                low[j] = np.minimum(low[j], coords[mask].min(axis=0))
+                high[j] = np.maximum(high[j], coords[mask].max(axis=0))
+    source.remove()
+
+    spans = []
+    for j, quadrant in enumerate(quadrants):
+        quadrant.close()
+        if quadrant.count > 0:
+            spans.append(_external_quad(
+                quadrant, np.concatenate([low[j], high[j]]), max_capacity, writer, spill, bucket, chunk_size,
+            ))
+        quadrant.remove()
+    writer.patch("part0_children", (index, slice(0, len(spans))), [child for child, _, _ in spans])
+    writer.patch("part0_hi", index, spans[-1][2])
+    return index, offset, spans[-1][2]
+
+
+class QuadTree(DynamicTree):
+    def __init__(
+        self, points: np.ndarray, max_capacity: int = 4, workers: int = 1, dtype: Optional[np.dtype] = None
+    ):
         if not isinstance(points, np.ndarray):
             raise TypeError("Points must be a NumPy ndarray.")
         if points.ndim != 2 or points.shape[1] != 2:
@@ -37,102 +238,309 @@ class QuadTree:
         xmax, ymax = points.max(axis=0)
         self.boundary = Rectangle(xmin, ymin, xmax, ymax)
 
-        all_indices = np.arange(points.shape[0])
-        self.root = self._build(all_indices)
+        # Duplikaty są scalane raz, w korzeniu; dalej budowa operuje na
+        # unikalnych punktach z wagami (krotnościami) i numerami pierwszych
+        # wierszy, więc o podziale węzła decyduje zwykła liczba elementów.
+        unique_points, counts, first_rows, row_order = group_duplicates(points)
+        stored = self._quantize(dtype, unique_points)
+        if workers > 1:
+            self._build_parallel(stored, counts, first_rows, workers)
+        else:
+            self._layout(stored, counts, first_rows)
+        self.row_order = regroup_rows(row_order, self.rows, np.diff(self.cum_counts))
+        self._init_parts(self)
+
+    @classmethod
+    def build_external(
+        cls,
+        source: Source,
+        path: str,
+        max_capacity: int = 4,
+        memory_budget: int = 1 << 30,
+        chunk_size: int = 1 << 20,
+        tmpdir: Optional[str] = None,
+    ) -> "QuadTree":
+        # Jak FlatKdTree.build_external: wynik to katalog w formacie save()
+        # otwierany przez load(), a części większe niż memory_budget są
+        # dzielone na ćwiartki w plikach tymczasowych w tmpdir.
+        points = copy_points(source, path, chunk_size)
+        bucket = max(bucket_size(memory_budget, BUILD_BYTES_PER_POINT), max_capacity)
+        chunk_size = min(chunk_size, bucket)
+        writer = IndexWriter(path, {
+            "coords": (points.dtype, (2,)),
+            "counts": (np.int64, ()),
+            "rows": (np.intp, ()),
+            "row_order": (np.intp, ()),
+            "part0_bounds": (points.dtype, (4,)),
+            "part0_children": (quad_index_dtype(len(points)), (4,)),
+            "part0_lo": (quad_index_dtype(len(points)), ()),
+            "part0_hi": (quad_index_dtype(len(points)), ()),
+        })
+        spill = spill_directory(tmpdir)
+        try:
+            _external_quad(
+                Chunks(points.dtype, points=points), bounds(points, chunk_size), max_capacity,
+                writer, spill, bucket, chunk_size,
+            )
+            n_coords = writer.sizes["coords"]
+            writer.finish()
+        finally:
+            shutil.rmtree(spill, ignore_errors=True)
+        cumulative_counts(path, chunk_size)
+        del points
+        write_manifest(path, cls, {"max_capacity": max_capacity}, n_coords)
+        return cls.load(path, mmap=True)
 
-    def _build(self, indices: np.ndarray) -> Optional[QuadTreeNode]:
-        if len(indices) == 0:
-            return None
+    def _build_parallel(
+        self, points: np.ndarray, weights: np.ndarray, rows: np.ndarray, workers: int
+    ) -> None:
+        # Górne poziomy dzielimy tak samo jak build_quad, ale na numerach punktów;
+        # ćwiartki z poziomu split_depth są budowane w procesach roboczych, a
+        # ich płaskie tablice sklejane w kolejności preorder. Wynik jest taki
+        # sam jak przy budowie sekwencyjnej.
+        split_depth = int(np.ceil(np.log(workers) / np.log(4))) + 1
+        task_ids = []
 
-        sub_points = self.points[indices]
-        xmin, ymin = sub_points.min(axis=0)
-        xmax, ymax = sub_points.max(axis=0)
-        boundary = Rectangle(xmin, ymin, xmax, ymax)
+        def split(ids: np.ndarray, depth: int) -> tuple:
+            if depth == split_depth or len(ids) <= self.max_capacity:
+                task_ids.append(ids)
+                return ("task", len(task_ids) - 1)
+            p = points[ids]
+            low, high = p.min(axis=0), p.max(axis=0)
+            quadrant = split_points(p, low, high)
+            children = [
+                split(ids[quadrant == j], depth + 1) for j in range(4) if np.any(quadrant == j)
+            ]
+            return ("node", np.concatenate([low, high]), children)
 
-        unique_points, counts = np.unique(sub_points, axis=0, return_counts=True)
+        skeleton = split(np.arange(len(points)), 0)
+        ends = np.cumsum([len(ids) for ids in task_ids]).tolist()
+        tasks = [(end - len(ids), end, self.max_capacity) for ids, end in zip(task_ids, ends)]
+        shared = {"points": points, "weights": weights, "rows": rows, "ids": np.concatenate(task_ids)}
+        results = run_tasks(_quad_segment, shared, tasks, workers)
 
-        if len(unique_points) <= self.max_capacity:
-            point_counts = {
-                (p[0], p[1]): c
-                for p, c in zip(unique_points, counts)
-            }
-            return QuadTreeNode(boundary=boundary, point_counts=point_counts)
+        blocks = []
+        offsets = {"node": 0, "point": 0}
 
-        xmid = (xmin + xmax) / 2
-        ymid = (ymin + ymax) / 2
+        def emit(item: tuple) -> Tuple[int, int, int]:
+            index = offsets["node"]
+            if item[0] == "task":
+                bounds, children, lo, hi, coords, counts, task_rows = results[item[1]]
+                children = np.where(children >= 0, children.astype(np.int64) + index, -1)
+                lo, hi = lo.astype(np.int64) + offsets["point"], hi.astype(np.int64) + offsets["point"]
+                blocks.append((bounds, children, lo, hi, coords, counts, task_rows))
+                offsets["node"] += len(bounds)
+                offsets["point"] += len(coords)
+                return index, int(lo[0]), int(hi[0])
+            block = (
+                np.array([item[1]], dtype=points.dtype), np.full((1, 4), -1, dtype=np.int64),
+                np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64),
+                np.empty((0, 2), dtype=points.dtype), np.empty(0, dtype=np.int64),
+                np.empty(0, dtype=rows.dtype),
+            )
+            blocks.append(block)
+            offsets["node"] += 1
+            spans = [emit(child) for child in item[2]]
+            block[1][0, :len(spans)] = [child for child, _, _ in spans]
+            block[2][0], block[3][0] = spans[0][1], spans[-1][2]
+            return index, spans[0][1], spans[-1][2]
 
-        bl_mask = (sub_points[:, 0] <= xmid) & (sub_points[:, 1] <= ymid)
-        br_mask = (sub_points[:, 0] >  xmid) & (sub_points[:, 1] <= ymid)
-        tl_mask = (sub_points[:, 0] <= xmid) & (sub_points[:, 1] >  ymid)
-        tr_mask = (sub_points[:, 0] >  xmid) & (sub_points[:, 1] >  ymid)
+        emit(skeleton)
+        (self.bounds, self.children, self.lo, self.hi,
+         self.coords, counts, self.rows) = (np.concatenate(part) for part in zip(*blocks))
+        index_dtype = quad_index_dtype(len(points))
+        self.children, self.lo, self.hi = (
+            values.astype(index_dtype) for values in (self.children, self.lo, self.hi)
+        )
+        self.cum_counts = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+        self._nodes = None
 
-        bl_indices = indices[bl_mask]
-        br_indices = indices[br_mask]
-        tl_indices = indices[tl_mask]
-        tr_indices = indices[tr_mask]
+    # Obiekty węzłów są tylko widokiem na tablice; drzewo wczytane z dysku
+    # odtwarza je dopiero przy pierwszym odwołaniu.
+    @property
+    def root(self) -> Optional[QuadTreeNode]:
+        return self.nodes[0] if self.nodes else None
 
-        children = []
-        for child_indices in [bl_indices, br_indices, tl_indices, tr_indices]:
-            child_node = self._build(child_indices)
-            if child_node is not None:
-                children.append(child_node)
+    @property
+    def nodes(self) -> List[QuadTreeNode]:
+        if self._nodes is None:
+            self._nodes = self._unflatten()
+        return self._nodes
 
-        node = QuadTreeNode(boundary=boundary, children=children, point_counts=None)
-        return node
+    def _unflatten(self) -> List[QuadTreeNode]:
+        nodes = [None] * len(self.bounds)
+        bounds = self._original_bounds(self.bounds)
+        for i in range(len(self.bounds) - 1, -1, -1):
+            xmin, ymin, xmax, ymax = bounds[i].tolist()
+            boundary = Rectangle(xmin, ymin, xmax, ymax)
+            lo, hi = int(self.lo[i]), int(self.hi[i])
+            if self.children[i, 0] < 0:
+                nodes[i] = QuadTreeNode(
+                    boundary=boundary, points=self._leaf_points(lo, hi),
+                    counts=np.diff(self.cum_counts[lo:hi + 1]), indices=self.rows[lo:hi],
+                )
+            else:
+                nodes[i] = QuadTreeNode(
+                    boundary=boundary,
+                    children=[nodes[j] for j in self.children[i].tolist() if j >= 0],
+                )
+        return nodes
 
-    def search_rectangle(self, rectangle: Rectangle) -> Generator[Tuple[float, float], None, None]:
-        if self.root is None:
-            return
-        yield from self._search_rectangle(self.root, rectangle, seen=set())
+    def _layout(self, points: np.ndarray, weights: np.ndarray, rows: np.ndarray) -> None:
+        # Tablicowa struktura drzewa (węzły w kolejności preorder). Punkty
+        # liści leżą w self.coords jeden za drugim, więc każde poddrzewo
+        # zajmuje przedział [lo, hi); obiekty węzłów powstają dopiero na
+        # żądanie (nodes) i przechowują jedynie widoki na te tablice.
+        order, self.bounds, self.children, self.lo, self.hi = build_quad(points, self.max_capacity)
+        self.coords = points[order]
+        self.rows = rows[order]
+        self.cum_counts = np.concatenate([[0], np.cumsum(weights[order], dtype=np.int64)])
+        self._nodes = None
 
-    def _search_rectangle(
-        self,
-        node: QuadTreeNode,
-        rectangle: Rectangle,
-        seen: set
-    ) -> Generator[Tuple[float, float], None, None]:
-        if node is None:
-            return
+    # Przy zmniejszonej precyzji obiekty węzłów pokazują współrzędne wejścia:
+    # obwiednie odkodowane, a punkty liści to kopie oryginałów, nie widoki.
 
-        if not rectangle.intersects(node.boundary):
-            return
+    def _original_bounds(self, bounds: np.ndarray) -> np.ndarray:
+        if self.quantizer is None:
+            return bounds
+        return np.hstack([self.quantizer.decode(bounds[..., :2]), self.quantizer.decode(bounds[..., 2:])])
 
-        if node.is_leaf():
-            for (px, py), count in (node.point_counts or {}).items():
-                if (px, py) not in seen and rectangle.contains((px, py)):
-                    seen.add((px, py))
-                    yield (px, py)
-        else:
-            for child in node.children:
-                yield from self._search_rectangle(child, rectangle, seen)
+    def _leaf_points(self, lo: int, hi: int) -> np.ndarray:
+        return self.coords[lo:hi] if self.quantizer is None else self._original(np.arange(lo, hi))
 
+    def _refresh_nodes(self) -> None:
+        # Obiekty węzłów drzewa głównego widzą bieżące tablice: liście mają
+        # widoki na swoje fragmenty, a liczniki są różnicami sum krotności.
+        if self._nodes is None:
+            return
+        totals = (self.cum_counts[self.hi] - self.cum_counts[self.lo]).tolist()
+        for node, lo, hi, count in zip(self._nodes, self.lo.tolist(), self.hi.tolist(), totals):
+            if node.is_leaf():
+                node.points = self._leaf_points(lo, hi)
+                node.counts = np.diff(self.cum_counts[lo:hi + 1])
+                node.indices = self.rows[lo:hi]
+            node.count = count
+
+    def search_rectangle(self, rectangle: Rectangle) -> Generator[Tuple[float, float], None, None]:
+        for x, y in self._original(self._search(rectangle)).tolist():
+            yield (x, y)
 
     def search_rectangle_with_count(self, rectangle: Rectangle) -> Generator[Tuple[Tuple[float, float], int], None, None]:
-        if self.root is None:
-            return  
-        yield from self._search_rectangle_with_count(self.root, rectangle, seen=set())
+        hits = self._search(rectangle)
+        for (x, y), count in zip(self._original(hits).tolist(), self._weights(hits).tolist()):
+            yield ((x, y), count)
 
-    def _search_rectangle_with_count(
-        self,
-        node: QuadTreeNode,
-        rectangle: Rectangle,
-        seen: set
-    ) -> Generator[Tuple[Tuple[float, float], int], None, None]:
-        if node is None:
-            return
+    def search_radius(self, center: Tuple[float, float], radius: float) -> Generator[Tuple[float, float], None, None]:
+        for x, y in self._original(self._search_radius(center, radius)).tolist():
+            yield (x, y)
 
-        if not rectangle.intersects(node.boundary):
-            return
+    def search_polygon(self, vertices: np.ndarray) -> Generator[Tuple[float, float], None, None]:
+        for x, y in self._original(self._search_polygon(vertices)).tolist():
+            yield (x, y)
 
-        if node.is_leaf():
-            for (px, py), count in node.point_counts.items():
-                if (px, py) not in seen and rectangle.contains((px, py)):
-                    seen.add((px, py))
-                    yield ((px, py), count)
-        else:
-            for child in node.children:
-                yield from self._search_rectangle_with_count(child, rectangle, seen)
+    def _search(self, rectangle: Rectangle) -> np.ndarray:
+        return self._range(from_rectangle(rectangle))[1]
 
+    def query_many(self, rects: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        rects = as_rectangles(rects)
+        queries, hits = self._range(rects)
+        offsets, order = csr_order(len(rects), queries)
+        hits = hits[order]
+        return offsets, self.rows[hits], self._weights(hits)
+
+    def count_rectangle(self, rectangle: Rectangle) -> int:
+        return int(self.count_many(from_rectangle(rectangle))[0])
+
+    def _part_range(self, part: Any, coords: np.ndarray, rects: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return quad_range(part.bounds, part.children, part.lo, part.hi, coords, rects)
+
+    def _part_count(
+        self, part: Any, coords: np.ndarray, cum_counts: np.ndarray, rects: np.ndarray
+    ) -> np.ndarray:
+        return quad_count(part.bounds, part.children, part.lo, part.hi, coords, cum_counts, rects)
+
+    def _part_disk(
+        self, part: Any, coords: np.ndarray, circles: np.ndarray
+    ) -> Tuple[Tuple[np.ndarray, np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray]]:
+        return quad_disk(part.bounds, part.children, part.lo, part.hi, coords, circles)
+
+    def _part_polygon(
+        self, part: Any, coords: np.ndarray, polygon: Polygon
+    ) -> Tuple[Tuple[np.ndarray, np.ndarray], np.ndarray]:
+        return quad_polygon(part.bounds, part.children, part.lo, part.hi, coords, polygon)
+
+    def _build_part(self, coords: np.ndarray) -> Tuple[np.ndarray, Any]:
+        # Pozycje są już unikalne (a przy zmniejszonej precyzji mogą mieć równe
+        # współrzędne), więc bez ponownego scalania duplikatów.
+        part = QuadTree.__new__(QuadTree)
+        part.max_capacity = self.max_capacity
+        part._layout(coords, np.ones(len(coords), dtype=np.int64), np.arange(len(coords)))
+        xmin, ymin, xmax, ymax = self._original_bounds(part.bounds[0]).tolist()
+        part.boundary = Rectangle(xmin, ymin, xmax, ymax)
+        return part.rows, part
+
+    def _object_bytes(self) -> Dict[str, int]:
+        if self._nodes is None:
+            return {}
+        total = sys.getsizeof(self._nodes)
+        for node in self._nodes:
+            extreme = node.boundary.extreme
+            total += sys.getsizeof(node) + sys.getsizeof(node.boundary) + sys.getsizeof(node.children)
+            total += sys.getsizeof(extreme) + sum(sys.getsizeof(pair) + sum(map(sys.getsizeof, pair)) for pair in extreme)
+            if node.is_leaf():
+                total += sum(map(sys.getsizeof, (node.points, node.counts, node.indices)))
+        return {"nodes": total}
+
+    def _params(self) -> dict:
+        return {"max_capacity": self.max_capacity}
+
+    def _restore(self, params: dict) -> None:
+        self.max_capacity = params["max_capacity"]
+        self._nodes = None
+
+    def _part_arrays(self, part: Any) -> Dict[str, np.ndarray]:
+        return {"bounds": part.bounds, "children": part.children, "lo": part.lo, "hi": part.hi}
+
+    def _part_from_arrays(self, arrays: Dict[str, np.ndarray]) -> Any:
+        part = QuadTree.__new__(QuadTree)
+        part.bounds, part.children, part.lo, part.hi = (
+            arrays[name] for name in ("bounds", "children", "lo", "hi")
+        )
+        xmin, ymin, xmax, ymax = self._original_bounds(part.bounds[0]).tolist()
+        part.boundary = Rectangle(xmin, ymin, xmax, ymax)
+        part._nodes = None
+        return part
+
+    def _assign(
+        self, coords: np.ndarray, rows: np.ndarray, row_order: np.ndarray,
+        cum_counts: np.ndarray, main: Optional[Any] = None,
+    ) -> None:
+        if main is not None:
+            self._nodes, self.boundary = main._nodes, main.boundary
+            self.bounds, self.children, self.lo, self.hi = main.bounds, main.children, main.lo, main.hi
+        self.coords = coords
+        self.cum_counts = cum_counts
+        self.rows = rows
+        self.row_order = row_order
+
+    def _refresh(self, touched: Optional[np.ndarray]) -> None:
+        # Po zmianie w miejscu poprawiane są tylko węzły nad zmienionymi
+        # pozycjami drzewa głównego - punkty liści to widoki buforów, ale
+        # krotności liścia są liczone z cum_counts od nowa.
+        if self._nodes is None or touched is None:
+            self._refresh_nodes()
+            return
+        n_main = self.parts[0][1]
+        for position in np.unique(touched[touched < n_main]).tolist():
+            i = 0
+            while i >= 0:
+                lo, hi = int(self.lo[i]), int(self.hi[i])
+                self._nodes[i].count = int(self.cum_counts[hi] - self.cum_counts[lo])
+                if self.children[i, 0] < 0:
+                    self._nodes[i].points = self._leaf_points(lo, hi)
+                    self._nodes[i].counts = np.diff(self.cum_counts[lo:hi + 1])
+                    break
+                i = next((j for j in self.children[i].tolist() if j >= 0 and self.lo[j] <= position < self.hi[j]), -1)
 
 
 # def main():
@@ -0,0 +1,49 @@
+import numpy as np
+from typing import Tuple
+from .rectangle import Rectangle
+
+
+def as_rectangles(rects: np.ndarray) -> np.ndarray:
+    rects = np.asarray(rects, dtype=np.float64)
+    if rects.ndim != 2 or rects.shape[1] != 4:
+        raise ValueError("Rectangles array must be of shape (n_rectangles, 4).")
+    if np.any(rects[:, 0] > rects[:, 2]) or np.any(rects[:, 1] > rects[:, 3]):
+        raise ValueError("Invalid rectangle definition")
+    return rects
+
+
+def as_circles(centers: np.ndarray, radii: np.ndarray) -> np.ndarray:
+    centers = np.asarray(centers, dtype=np.float64)
+    if centers.ndim != 2 or centers.shape[1] != 2:
+        raise ValueError("Centers array must be of shape (n_circles, 2).")
+    radii = np.broadcast_to(np.asarray(radii, dtype=np.float64), (len(centers),))
+    if np.any(~(radii >= 0)):
+        raise ValueError("Invalid circle definition")
+    return np.column_stack([centers, radii])
+
+
+def as_points(points: np.ndarray) -> np.ndarray:
+    if not isinstance(points, np.ndarray):
+        raise TypeError("Points must be a NumPy ndarray.")
+    if points.ndim != 2 or points.shape[1] != 2:
+        raise ValueError("Points array must be of shape (n_points, 2).")
+    return points
+
+
+def from_rectangle(rectangle: Rectangle) -> np.ndarray:
+    (xmin, xmax), (ymin, ymax) = rectangle.extreme
+    return np.array([[xmin, ymin, xmax, ymax]], dtype=np.float64)
+
+
+def bounding_box(coords: np.ndarray) -> np.ndarray:
+    if len(coords) == 0:
+        return np.full(4, np.nan)
+    return np.concatenate([coords.min(axis=0), coords.max(axis=0)]).astype(np.float64)
+
+
+def csr_order(n_queries: int, queries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Trafienia zebrane w kolejności przechodzenia drzewa są grupowane po
+    # numerze zapytania; sortowanie stabilne zachowuje kolejność w grupie.
+    offsets = np.zeros(n_queries + 1, dtype=np.int64)
+    np.cumsum(np.bincount(queries, minlength=n_queries), out=offsets[1:])
+    return offsets, np.argsort(queries, kind="stable")
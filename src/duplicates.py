@@ -0,0 +1,25 @@
+import numpy as np
+from typing import Tuple
+
+
+def group_duplicates(points: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # Jedno stabilne sortowanie leksykograficzne grupuje identyczne wiersze;
+    # row_order to numery wierszy wejścia ułożone grupami, w każdej grupie
+    # rosnąco, więc pierwszy wiersz grupy jest jej najmniejszym numerem.
+    row_order = np.lexsort(points.T[::-1])
+    ordered = points[row_order]
+    new_group = np.ones(len(points), dtype=bool)
+    new_group[1:] = np.any(ordered[1:] != ordered[:-1], axis=1)
+    starts = np.flatnonzero(new_group)
+    counts = np.diff(np.append(starts, len(points))).astype(np.int64)
+    return ordered[starts], counts, row_order[starts], row_order
+
+
+def regroup_rows(row_order: np.ndarray, first_rows: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    # Przestawia grupy wierszy z row_order w kolejność zadaną przez ich
+    # pierwsze wiersze (np. kolejność węzłów drzewa).
+    position = np.empty(len(row_order), dtype=np.intp)
+    position[row_order] = np.arange(len(row_order))
+    starts = position[first_rows]
+    offsets = np.cumsum(counts) - counts
+    return row_order[np.arange(counts.sum()) - np.repeat(offsets - starts, counts)]
@@ -0,0 +1,575 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+from .batch import as_circles, as_points, as_rectangles, csr_order, from_rectangle
+from .duplicates import group_duplicates
+from .polygon import Polygon
+from .quantize import Quantizer
+from .rectangle import Rectangle
+from .traversal import expand_ranges, in_disks
+
+
+FORMAT_VERSION = 1
+
+
+def reserve(values: np.ndarray, used: int, size: int, dtype: Optional[np.dtype] = None) -> np.ndarray:
+    # Bufor o pojemności co najmniej size z zachowaniem used pierwszych
+    # elementów; pojemność rośnie co najmniej dwukrotnie, więc dopisywanie
+    # kosztuje zamortyzowane O(1) na element. Typ jest poszerzany, gdy
+    # dopisywane wartości go wymagają (np. float do drzewa z int).
+    dtype = values.dtype if dtype is None else np.result_type(values.dtype, dtype)
+    if len(values) >= size and dtype == values.dtype:
+        return values
+    out = np.empty((max(size, 2 * len(values)),) + values.shape[1:], dtype=dtype)
+    out[:used] = values[:used]
+    return out
+
+
+def replace_directory(source: str, target: str) -> None:
+    # Podmiana katalogu target na source (ten sam system plików). Stary
+    # katalog jest najpierw przenoszony obok, więc target nigdy nie zawiera
+    # mieszanki plików starego i nowego indeksu.
+    if not os.path.exists(target):
+        os.replace(source, target)
+        return
+    backup = source + ".old"
+    os.replace(target, backup)
+    os.replace(source, target)
+    shutil.rmtree(backup, ignore_errors=True)
+
+
+class DynamicTree:
+    # Aktualizacje metodą logarytmiczną: struktura to statyczne drzewo główne
+    # i ciąg coraz mniejszych drzew pomocniczych (przebiegów). Każda część
+    # zajmuje przedział [start, stop) wspólnych tablic coords / krotności,
+    # więc zapytanie to te same silniki wywołane osobno dla każdej części.
+    # Nowe punkty tworzą przebieg scalany z sąsiadami nie większymi od niego,
+    # dzięki czemu części jest O(log n), a każdy punkt jest przebudowywany
+    # O(log n) razy. Usunięcie zeruje krotność (nagrobek); gdy nagrobków jest
+    # więcej niż żywych punktów, całość jest przebudowywana.
+    #
+    # Zmiany piszą w miejscu, w buforach z zapasem pojemności (reserve):
+    # scalenie przepisuje tylko przedział scalanych części, a grupy wierszy
+    # punktów już obecnych są przenoszone na koniec row_order (row_start
+    # wskazuje początek grupy), więc koszt zmiany zależy od scalanych części
+    # i zmienianych grup, a nie od wielkości całego drzewa.
+    #
+    # Klasa bazowa dostarcza: _part_range, _part_count, _part_disk,
+    # _part_polygon, _build_part, _assign oraz do zapisu _params, _restore,
+    # _part_arrays i _part_from_arrays; opcjonalnie _object_bytes i _refresh.
+    #
+    # Z quantizer współrzędne coords są w zmniejszonej precyzji (patrz
+    # Quantizer): silniki dostają poszerzone zapytania, a kandydaci są
+    # sprawdzani na oryginalnych współrzędnych z self.points.
+
+    parts: List[Tuple[int, int, Any]]
+    quantizer: Optional[Quantizer] = None
+
+    def _quantize(self, dtype: Optional[np.dtype], points: np.ndarray) -> np.ndarray:
+        # Współrzędne do budowy drzewa; dtype None lub równy typowi wejścia
+        # oznacza pełną precyzję.
+        if dtype is None or np.dtype(dtype) == points.dtype:
+            self.quantizer = None
+            return points
+        self.quantizer = Quantizer(dtype, points)
+        return self.quantizer.store(points)
+
+    def _store(self, points: np.ndarray) -> np.ndarray:
+        return points if self.quantizer is None else self.quantizer.store(points)
+
+    def _original(self, positions: np.ndarray) -> np.ndarray:
+        # Oryginalne współrzędne pozycji (z pierwszego wiersza punktu); nagrobki
+        # nie mają wiersza, więc dla nich zostają współrzędne odkodowane.
+        if self.quantizer is None:
+            return self.coords[positions]
+        rows = self.rows[positions]
+        return np.where(
+            (rows >= 0)[:, None], self.points[np.maximum(rows, 0)], self.quantizer.decode(self.coords[positions])
+        )
+
+    def _init_parts(self, main: Any) -> None:
+        self.parts = [(0, len(self.coords), main)]
+        # Zaraz po budowie grupy wierszy leżą w row_order w kolejności pozycji;
+        # bufory do zmian w miejscu powstają przy pierwszej zmianie.
+        self.row_start = self.cum_counts[:-1]
+        self._buffers = None
+
+    def _all_hits(self, rects: np.ndarray, main_only: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        if self.quantizer is not None:
+            rects = self.quantizer.rectangles(rects)
+        queries, hits = [], []
+        for start, stop, part in self.parts[:1] if main_only else self.parts:
+            q, h = self._part_range(part, self.coords[start:stop], rects)
+            queries.append(q)
+            hits.append(h + start)
+        return np.concatenate(queries), np.concatenate(hits)
+
+    def _range(self, rects: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        queries, hits = self._all_hits(rects)
+        live = self.cum_counts[hits + 1] > self.cum_counts[hits]
+        queries, hits = queries[live], hits[live]
+        if self.quantizer is not None:
+            p, r = self._original(hits), rects[queries]
+            inside = (r[:, 0] <= p[:, 0]) & (p[:, 0] <= r[:, 2]) & (r[:, 1] <= p[:, 1]) & (p[:, 1] <= r[:, 3])
+            queries, hits = queries[inside], hits[inside]
+        return queries, hits
+
+    def _weights(self, hits: np.ndarray) -> np.ndarray:
+        # Krotności pozycji jako różnice sum prefiksowych - osobnej tablicy
+        # krotności drzewo nie trzyma.
+        return self.cum_counts[hits + 1] - self.cum_counts[hits]
+
+    def _weighted_counts(self, n_queries: int, queries: np.ndarray, hits: np.ndarray) -> np.ndarray:
+        return np.bincount(queries, self._weights(hits), minlength=n_queries).astype(np.int64)
+
+    def count_many(self, rects: np.ndarray) -> np.ndarray:
+        rects = as_rectangles(rects)
+        # Poddrzewa w całości w prostokącie są liczone bez sprawdzania punktów,
+        # więc przy zmniejszonej precyzji liczone są sprawdzone trafienia.
+        if self.quantizer is not None:
+            return self._weighted_counts(len(rects), *self._range(rects))
+        totals = np.zeros(len(rects), dtype=np.int64)
+        for start, stop, part in self.parts:
+            totals += self._part_count(
+                part, self.coords[start:stop], self.cum_counts[start:stop + 1], rects
+            )
+        return totals
+
+    # Wyniki jako numery wierszy wejścia (self.points), razem ze wszystkimi
+    # duplikatami: wiersze pozycji i to row_order[row_start[i]:row_start[i] + c]
+    # dla krotności c, więc trafienia zamieniają się na wiersze jednym
+    # expand_ranges.
+
+    def _rows(self, hits: np.ndarray) -> np.ndarray:
+        lo = self.row_start[hits]
+        return self.row_order[expand_ranges(hits, lo, lo + self.cum_counts[hits + 1] - self.cum_counts[hits])[1]]
+
+    def _row_csr(self, n_queries: int, queries: np.ndarray, hits: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        sizes = self.cum_counts[hits + 1] - self.cum_counts[hits]
+        offsets = np.zeros(n_queries + 1, dtype=np.int64)
+        np.cumsum(np.bincount(queries, sizes, minlength=n_queries).astype(np.int64), out=offsets[1:])
+        return offsets, self._rows(hits[np.argsort(queries, kind="stable")])
+
+    def search_rectangle_rows(self, rectangle: Rectangle) -> np.ndarray:
+        return self._rows(self._range(from_rectangle(rectangle))[1])
+
+    def query_rows_many(self, rects: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        rects = as_rectangles(rects)
+        return self._row_csr(len(rects), *self._range(rects))
+
+    def _disk(
+        self, circles: np.ndarray
+    ) -> Tuple[Tuple[np.ndarray, np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray]]:
+        covered, hits = ([], [], []), ([], [])
+        for start, stop, part in self.parts:
+            (cq, clo, chi), (q, h) = self._part_disk(part, self.coords[start:stop], circles)
+            for target, values in zip(covered + hits, (cq, clo + start, chi + start, q, h + start)):
+                target.append(values)
+        covered, hits = (tuple(np.concatenate(values) for values in group) for group in (covered, hits))
+        return covered, hits
+
+    def _radius_range(self, circles: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        (cq, clo, chi), (q, h) = self._disk(circles if self.quantizer is None else self.quantizer.circles(circles))
+        cq, ch = expand_ranges(cq, clo, chi)
+        queries, hits = np.concatenate([cq, q]), np.concatenate([ch, h])
+        live = self.cum_counts[hits + 1] > self.cum_counts[hits]
+        queries, hits = queries[live], hits[live]
+        if self.quantizer is not None:
+            inside = in_disks(self._original(hits), circles[queries])
+            queries, hits = queries[inside], hits[inside]
+        return queries, hits
+
+    def _search_radius(self, center: Tuple[float, float], radius: float) -> np.ndarray:
+        return self._radius_range(as_circles([center], radius))[1]
+
+    def query_radius_many(self, centers: np.ndarray, radii: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        circles = as_circles(centers, radii)
+        queries, hits = self._radius_range(circles)
+        offsets, order = csr_order(len(circles), queries)
+        hits = hits[order]
+        return offsets, self.rows[hits], self.cum_counts[hits + 1] - self.cum_counts[hits]
+
+    def search_radius_rows(self, center: Tuple[float, float], radius: float) -> np.ndarray:
+        return self._rows(self._search_radius(center, radius))
+
+    def query_radius_rows_many(self, centers: np.ndarray, radii: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        circles = as_circles(centers, radii)
+        return self._row_csr(len(circles), *self._radius_range(circles))
+
+    def count_radius(self, center: Tuple[float, float], radius: float) -> int:
+        return int(self.count_radius_many([center], radius)[0])
+
+    def count_radius_many(self, centers: np.ndarray, radii: np.ndarray) -> np.ndarray:
+        circles = as_circles(centers, radii)
+        if self.quantizer is not None:
+            return self._weighted_counts(len(circles), *self._radius_range(circles))
+        (cq, clo, chi), (q, h) = self._disk(circles)
+        totals = np.zeros(len(circles), dtype=np.int64)
+        for queries, lo, hi in ((cq, clo, chi), (q, h, h + 1)):
+            totals += np.bincount(
+                queries, self.cum_counts[hi] - self.cum_counts[lo], minlength=len(circles)
+            ).astype(np.int64)
+        return totals
+
+    def _polygon_range(self, vertices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Pozycje punktów w wielokącie: pokryte przedziały oraz trafienia.
+        # Przy zmniejszonej precyzji kandydaci pochodzą z obwiedni wielokąta
+        # i są sprawdzani na oryginalnych współrzędnych.
+        polygon = Polygon(vertices)
+        if self.quantizer is not None:
+            _, hits = self._range(polygon.bbox[None])
+            empty = np.zeros(0, dtype=np.intp)
+            return (empty, empty), hits[polygon.contains(self._original(hits))]
+        covered, hits = ([], []), []
+        for start, stop, part in self.parts:
+            (clo, chi), h = self._part_polygon(part, self.coords[start:stop], polygon)
+            covered[0].append(clo + start)
+            covered[1].append(chi + start)
+            hits.append(h + start)
+        return (np.concatenate(covered[0]), np.concatenate(covered[1])), np.concatenate(hits)
+
+    def _search_polygon(self, vertices: np.ndarray) -> np.ndarray:
+        (lo, hi), hits = self._polygon_range(vertices)
+        hits = np.concatenate([expand_ranges(lo, lo, hi)[1], hits])
+        return hits[self.cum_counts[hits + 1] > self.cum_counts[hits]]
+
+    def search_polygon_rows(self, vertices: np.ndarray) -> np.ndarray:
+        return self._rows(self._search_polygon(vertices))
+
+    def count_polygon(self, vertices: np.ndarray) -> int:
+        (lo, hi), hits = self._polygon_range(vertices)
+        total = (self.cum_counts[hi] - self.cum_counts[lo]).sum()
+        return int(total + (self.cum_counts[hits + 1] - self.cum_counts[hits]).sum())
+
+    def _locate(self, points: np.ndarray, main_only: bool = False) -> np.ndarray:
+        # Pozycja każdego (unikalnego) punktu we wspólnych tablicach lub -1;
+        # zwykłe zapytanie o zdegenerowane prostokąty, nagrobki też się liczą.
+        positions = np.full(len(points), -1, dtype=np.intp)
+        queries, hits = self._all_hits(np.hstack([points, points]).astype(np.float64), main_only)
+        # Przy zmniejszonej precyzji prostokąt trafia też w punkty o tych samych
+        # współrzędnych zakodowanych; nagrobki nie mają już oryginału.
+        if self.quantizer is not None:
+            known = self.rows[hits] >= 0
+            queries, hits = queries[known], hits[known]
+            same = np.all(self.points[self.rows[hits]] == points[queries], axis=1)
+            queries, hits = queries[same], hits[same]
+        positions[queries] = hits
+        return positions
+
+    def _buffer(self) -> None:
+        # Przy pierwszej zmianie tablice trafiają do buforów (kopie tam, gdzie
+        # zmiana pisze w miejscu); atrybuty drzewa są potem ich widokami.
+        if self._buffers is not None:
+            return
+        self._buffers = {
+            "points": self.points,
+            "coords": self.coords,
+            "cum_counts": np.array(self.cum_counts, dtype=np.int64),
+            "rows": np.array(self.rows, dtype=np.intp),
+            "row_start": np.array(self.row_start, dtype=np.intp),
+            "row_order": self.row_order,
+        }
+        self._used = len(self.row_order)
+
+    def insert(self, points: np.ndarray) -> None:
+        points = as_points(points)
+        if len(points) == 0:
+            return
+
+        unique_points, counts, _, row_order = group_duplicates(points)
+        positions = self._locate(unique_points)
+        new = positions < 0
+        # Kodowanie przed zmianą stanu: punkty spoza zakresu dtype są
+        # odrzucane bez naruszania drzewa.
+        stored = self._store(unique_points[new])
+
+        self._buffer()
+        b = self._buffers
+        before = self._arrays()
+        n, n_rows = len(self.coords), len(self.points)
+        b["points"] = reserve(b["points"], n_rows, n_rows + len(points), points.dtype)
+        b["points"][n_rows:n_rows + len(points)] = points
+        self.points = b["points"][:n_rows + len(points)]
+
+        # Wiersze partii pogrupowane jak unique_points, w grupie rosnąco.
+        rows = n_rows + row_order
+        group = np.repeat(np.arange(len(unique_points)), counts)
+        old = ~new[group]
+        touched = positions[~new]
+        self._relocate(touched, counts[~new], rows[old])
+        self._add_counts(touched, counts[~new])
+        b["rows"][touched] = b["row_order"][b["row_start"][touched]]
+
+        main = None
+        if np.any(new):
+            size = np.count_nonzero(new)
+            k = len(self.parts)
+            while k > 0:
+                start, stop, _ = self.parts[k - 1]
+                part_size = np.count_nonzero(np.diff(b["cum_counts"][start:stop + 1]))
+                if part_size > size:
+                    break
+                size += part_size
+                k -= 1
+            main = self._merge(k, stored, counts[new], rows[~old])
+        self._compact()
+        self._publish(main, None if main is not None else self._touched(before, touched))
+
+    def delete(self, points: np.ndarray) -> int:
+        points = as_points(points)
+        if len(points) == 0:
+            return 0
+
+        unique_points, counts, _, _ = group_duplicates(points)
+        positions = self._locate(unique_points)
+        found = positions >= 0
+        positions, counts = positions[found], counts[found]
+        self._buffer()
+        b = self._buffers
+        before = self._arrays()
+        weights = b["cum_counts"][positions + 1] - b["cum_counts"][positions]
+        counts = np.minimum(counts, weights)
+
+        # W grupie pozycji wiersze są rosnące - usuwane są ostatnio dodane,
+        # czyli koniec grupy; zwolnione miejsca w row_order sprząta _compact.
+        self._add_counts(positions, -counts)
+        b["rows"][positions[weights == counts]] = -1
+
+        main = None
+        n = len(self.coords)
+        n_live = np.count_nonzero(np.diff(b["cum_counts"][:n + 1]))
+        if 0 < n_live < n - n_live:
+            empty = np.zeros(0, dtype=np.intp)
+            main = self._merge(0, self.coords[:0], empty, empty)
+        self._compact()
+        self._publish(main, None if main is not None else self._touched(before, positions))
+        return int(counts.sum())
+
+    def _relocate(self, positions: np.ndarray, counts: np.ndarray, rows: np.ndarray) -> None:
+        # Grupy wierszy pozycji (dotychczasowe żywe wiersze i dopisane rows,
+        # counts na pozycję) przenoszone na koniec row_order.
+        b = self._buffers
+        lo = b["row_start"][positions]
+        current = b["cum_counts"][positions + 1] - b["cum_counts"][positions]
+        q_old, idx = expand_ranges(np.arange(len(positions)), lo, lo + current)
+        q_new = np.repeat(np.arange(len(positions)), counts)
+        order = np.argsort(np.concatenate([q_old, q_new]), kind="stable")
+        grouped = np.concatenate([b["row_order"][idx], rows])[order]
+        sizes = current + counts
+        b["row_start"][positions] = self._append_rows(grouped) + np.cumsum(sizes) - sizes
+
+    def _append_rows(self, rows: np.ndarray) -> int:
+        b = self._buffers
+        b["row_order"] = reserve(b["row_order"], self._used, self._used + len(rows))
+        b["row_order"][self._used:self._used + len(rows)] = rows
+        self._used += len(rows)
+        return self._used - len(rows)
+
+    def _merge(self, k: int, new_points: np.ndarray, counts: np.ndarray, rows: np.ndarray) -> Optional[Any]:
+        # Części od k-tej do końca oraz nowe punkty (krotności counts, wiersze
+        # rows pogrupowane jak new_points) stają się jednym drzewem zapisanym
+        # w miejscu tych części; nagrobki z nich znikają. Grupy wierszy
+        # starych pozycji zostają w row_order, nowe są dopisywane na końcu.
+        b = self._buffers
+        n = len(self.coords)
+        start = self.parts[k][0] if k < len(self.parts) else n
+        weights = np.diff(b["cum_counts"][start:n + 1])
+        live = np.flatnonzero(weights > 0)
+        region = np.concatenate([b["coords"][start + live], new_points])
+        order, part = self._build_part(region)
+
+        new_start = self._append_rows(rows) + np.cumsum(counts) - counts
+        first_rows = b["row_order"][new_start]
+        values = {
+            "coords": region,
+            "rows": np.concatenate([b["rows"][start + live], first_rows]),
+            "row_start": np.concatenate([b["row_start"][start + live], new_start]),
+        }
+        size = start + len(region)
+        for name, value in values.items():
+            b[name] = reserve(b[name], n, size, value.dtype)
+            b[name][start:size] = value[order]
+        cum_counts = b["cum_counts"] = reserve(b["cum_counts"], n + 1, size + 1)
+        np.cumsum(np.concatenate([weights[live], counts])[order], out=cum_counts[start + 1:size + 1])
+        cum_counts[start + 1:size + 1] += cum_counts[start]
+        self.parts = self.parts[:k] + [(start, size, part)]
+        return part if k == 0 else None
+
+    def _add_counts(self, positions: np.ndarray, deltas: np.ndarray) -> None:
+        # Zmiana krotności (unikalnych) pozycji: sumy prefiksowe są liczone od
+        # nowa od pierwszej z nich, wcześniejsze zostają bez zmian.
+        if len(positions) == 0:
+            return
+        cum_counts = self._buffers["cum_counts"]
+        first, size = int(positions.min()), self.parts[-1][1]
+        weights = np.diff(cum_counts[first:size + 1])
+        weights[positions - first] += deltas
+        np.cumsum(weights, out=cum_counts[first + 1:size + 1])
+        cum_counts[first + 1:size + 1] += cum_counts[first]
+
+    def _compact(self) -> None:
+        # Gdy nieużytków w row_order (grup przeniesionych i wierszy usuniętych)
+        # jest więcej niż żywych wierszy, grupy są układane od nowa w
+        # kolejności pozycji - koszt zamortyzowany przez zmiany, które je
+        # wytworzyły.
+        b = self._buffers
+        size = self.parts[-1][1]
+        live_rows = int(b["cum_counts"][size])
+        if self._used <= 2 * live_rows + 1024:
+            return
+        lo = b["row_start"][:size]
+        _, idx = expand_ranges(np.arange(size), lo, lo + np.diff(b["cum_counts"][:size + 1]))
+        b["row_order"] = b["row_order"][idx]
+        b["row_start"][:size] = b["cum_counts"][:size]
+        self._used = live_rows
+
+    def _arrays(self) -> Tuple[np.ndarray, ...]:
+        # Bufory widziane przez obiekty węzłów; zmiana któregoś oznacza, że
+        # widoki trzeba utworzyć od nowa.
+        return tuple(self._buffers[name] for name in ("coords", "rows"))
+
+    def _touched(self, before: Tuple[np.ndarray, ...], positions: np.ndarray) -> Optional[np.ndarray]:
+        return positions if all(a is b for a, b in zip(before, self._arrays())) else None
+
+    def _publish(self, main: Optional[Any], touched: Optional[np.ndarray]) -> None:
+        # Atrybuty drzewa jako widoki buforów; touched to pozycje zmienione w
+        # miejscu (None - tablice mogły się przenieść albo zmienić wszędzie).
+        b = self._buffers
+        size = self.parts[-1][1]
+        self.row_start = b["row_start"][:size]
+        self._assign(
+            b["coords"][:size], b["rows"][:size], b["row_order"][:self._used], b["cum_counts"][:size + 1], main
+        )
+        self._refresh(touched)
+
+    def _refresh(self, touched: Optional[np.ndarray]) -> None:
+        return
+
+    # Zużycie pamięci: bajty każdej tablicy indeksu (części pod nazwami jak w
+    # save(), pozostałe pod nazwą atrybutu; każda tablica liczona raz) oraz
+    # obiektów Pythona, o ile już powstały. Tablice mapowane z dysku są
+    # liczone w całości, choć w pamięci są tylko odczytane strony.
+
+    def memory_report(self) -> Dict[str, int]:
+        arrays = [
+            (f"part{i}_{name}", values)
+            for i, (_, _, part) in enumerate(self.parts)
+            for name, values in self._part_arrays(part).items()
+        ]
+        arrays += [(name, values) for name, values in vars(self).items() if isinstance(values, np.ndarray)]
+        # Widoki buforów (i row_start jako widok cum_counts) liczone są jako
+        # cały bufor, razem z zapasem pojemności.
+        owners = {id(values): values for values in (self._buffers or {}).values()}
+        owners[id(self.cum_counts)] = self.cum_counts
+        report, seen = {}, set()
+        for name, values in arrays:
+            values = owners.get(id(values.base), values)
+            if id(values) not in seen:
+                seen.add(id(values))
+                report[name] = int(values.nbytes)
+        report.update(self._object_bytes())
+        return report
+
+    def nbytes(self) -> int:
+        return sum(self.memory_report().values())
+
+    def _object_bytes(self) -> Dict[str, int]:
+        return {}
+
+    # Zapis na dysk: katalog z płaskimi tablicami .npy i plikiem manifest.json
+    # (wersja formatu, klasa, parametry, podział na części). Zapis trafia do
+    # katalogu tymczasowego obok docelowego i podmienia go dopiero w całości
+    # (replace_directory), więc przerwany zapis nie psuje istniejącego indeksu,
+    # a zapis do katalogu, z którego drzewo jest zmapowane, nie obcina plików
+    # pod mapowaniem - stare pliki są tylko odłączane. Odczyt mapuje pliki do
+    # pamięci (tryb kopiowania przy zapisie): nic nie jest parsowane ani
+    # kopiowane, a procesy dzielą strony przez cache systemu.
+
+    def save(self, path: str) -> None:
+        path = os.path.abspath(path)
+        if os.path.isdir(path) and os.listdir(path) and not os.path.exists(os.path.join(path, "manifest.json")):
+            raise ValueError("Index directory is not empty and holds no index.")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        staging = f"{path}.save-{uuid.uuid4().hex}"
+        os.mkdir(staging)
+        try:
+            self._write(staging)
+            replace_directory(staging, path)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+    def fingerprint(self) -> str:
+        # Skrót zawartości indeksu (wiersze wejścia, współrzędne, krotności),
+        # zapisywany w manifeście - pozwala sprawdzić, czy indeks na dysku
+        # powstał z tych samych danych co drzewo w pamięci.
+        digest = hashlib.blake2b(digest_size=16)
+        for values in (self.points, self.coords, self.cum_counts, self.rows):
+            values = np.ascontiguousarray(values)
+            digest.update(f"{values.dtype.str}{values.shape}".encode())
+            digest.update(values.data)
+        return digest.hexdigest()
+
+    def _write(self, path: str) -> None:
+        arrays = {
+            "points": self.points,
+            "coords": self.coords,
+            "cum_counts": self.cum_counts,
+            "rows": self.rows,
+            "row_order": self._rows(np.arange(len(self.coords))),
+        }
+        for i, (_, _, part) in enumerate(self.parts):
+            for name, values in self._part_arrays(part).items():
+                arrays[f"part{i}_{name}"] = values
+        for name, values in arrays.items():
+            np.save(os.path.join(path, name + ".npy"), np.ascontiguousarray(values))
+
+        manifest = {
+            "format": FORMAT_VERSION,
+            "class": type(self).__name__,
+            "params": self._params(),
+            "parts": [[start, stop] for start, stop, _ in self.parts],
+            "arrays": sorted(arrays),
+            "fingerprint": self.fingerprint(),
+        }
+        if self.quantizer is not None:
+            manifest["quantizer"] = self.quantizer.state()
+        with open(os.path.join(path, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "DynamicTree":
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+        if manifest.get("format") != FORMAT_VERSION:
+            raise ValueError("Unsupported index format version.")
+        if manifest.get("class") != cls.__name__:
+            raise ValueError(f"Index was saved by {manifest.get('class')}, not {cls.__name__}.")
+
+        arrays = {
+            name: np.load(os.path.join(path, name + ".npy"), mmap_mode="c" if mmap else None)
+            for name in manifest["arrays"]
+        }
+        tree = cls.__new__(cls)
+        tree._restore(manifest["params"])
+        if "quantizer" in manifest:
+            tree.quantizer = Quantizer.from_state(manifest["quantizer"])
+        tree.points = arrays["points"]
+        tree.parts = []
+        for i, (start, stop) in enumerate(manifest["parts"]):
+            prefix = f"part{i}_"
+            part = tree._part_from_arrays(
+                {name[len(prefix):]: values for name, values in arrays.items() if name.startswith(prefix)}
+            )
+            tree.parts.append((start, stop, part))
+        tree._assign(
+            arrays["coords"], arrays["rows"], arrays["row_order"], arrays["cum_counts"], tree.parts[0][2]
+        )
+        # Zapis układa grupy wierszy w kolejności pozycji.
+        tree.row_start = tree.cum_counts[:-1]
+        tree._buffers = None
+        return tree
@@ -0,0 +1,106 @@
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+from .batch import as_rectangles
+from .dynamic import DynamicTree
+
+# Drzewo otwarte przez proces roboczy (jedno na proces, patrz _open).
+_tree: Optional[DynamicTree] = None
+
+
+def _open(cls: type, path: str) -> None:
+    global _tree
+    _tree = cls.load(path, mmap=True)
+
+
+def index_matches(tree: DynamicTree, path: str) -> bool:
+    # Czy zapisany w path indeks odpowiada drzewu: ta sama klasa, parametry,
+    # podział na części i skrót zawartości (DynamicTree.fingerprint).
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    return (
+        manifest.get("class") == type(tree).__name__
+        and manifest.get("params") == json.loads(json.dumps(tree._params()))
+        and manifest.get("parts") == [[start, stop] for start, stop, _ in tree.parts]
+        and manifest.get("fingerprint") == tree.fingerprint()
+    )
+
+
+def _query_chunk(rects: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    return _tree.query_many(rects)
+
+
+def _count_chunk(rects: np.ndarray) -> np.ndarray:
+    return _tree.count_many(rects)
+
+
+class QueryExecutor:
+    # Zapytania wsadowe rozdzielane między procesy. Indeks jest zapisywany raz
+    # do katalogu tymczasowego (lub podanego), a każdy proces roboczy mapuje go
+    # do pamięci przy starcie - drzewo nie jest przesyłane przez pickle, a
+    # strony są współdzielone przez cache systemu. Partie po chunk_size
+    # prostokątów wyrównują obciążenie; wyniki wracają w kolejności wejścia.
+    # Z reuse=True indeks zapisany już w path jest używany bez ponownego
+    # zapisu, o ile odpowiada drzewu (index_matches); inaczej path jest
+    # nadpisywany bieżącym drzewem.
+    def __init__(
+        self,
+        tree: DynamicTree,
+        workers: Optional[int] = None,
+        chunk_size: int = 1024,
+        path: Optional[str] = None,
+        reuse: bool = False,
+    ):
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be a positive integer.")
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self._owned = path is None
+        self.path = tempfile.mkdtemp(prefix="index-") if path is None else path
+        saved = not self._owned and reuse and os.path.exists(os.path.join(self.path, "manifest.json"))
+        if saved and not index_matches(tree, self.path):
+            raise ValueError("Index at path does not match the tree.")
+        if not saved:
+            tree.save(self.path)
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_open, initargs=(type(tree), self.path)
+        )
+
+    def _chunks(self, rects: np.ndarray) -> list:
+        return [rects[i:i + self.chunk_size] for i in range(0, len(rects), self.chunk_size)]
+
+    def query_many(self, rects: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        rects = as_rectangles(rects)
+        results = list(self.pool.map(_query_chunk, self._chunks(rects)))
+        offsets = np.zeros(len(rects) + 1, dtype=np.int64)
+        rows, counts, base, start = [], [], 0, 0
+        for chunk_offsets, chunk_rows, chunk_counts in results:
+            n = len(chunk_offsets) - 1
+            offsets[start + 1:start + n + 1] = chunk_offsets[1:] + base
+            rows.append(chunk_rows)
+            counts.append(chunk_counts)
+            base += int(chunk_offsets[-1])
+            start += n
+        if not results:
+            return offsets, np.empty(0, dtype=np.intp), np.empty(0, dtype=np.int64)
+        return offsets, np.concatenate(rows), np.concatenate(counts)
+
+    def count_many(self, rects: np.ndarray) -> np.ndarray:
+        rects = as_rectangles(rects)
+        results = list(self.pool.map(_count_chunk, self._chunks(rects)))
+        return np.concatenate(results) if results else np.zeros(0, dtype=np.int64)
+
+    def close(self) -> None:
+        self.pool.shutdown()
+        if self._owned:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self) -> "QueryExecutor":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,203 @@
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from .dynamic import FORMAT_VERSION
+
+# Budowa poza pamięcią: punkty są czytane partiami z pliku .npy mapowanego do
+# pamięci albo z iteratora partii, a górne poziomy drzewa dzielą je na pliki
+# tymczasowe (rekordy x, y, numer wiersza) tak długo, aż część zmieści się
+# w budżecie pamięci - ją buduje zwykła budowa w pamięci. Tablice indeksu są
+# dopisywane na dysk w kolejności preorder, więc wynik to katalog w formacie
+# save(), otwierany przez load() z mapowaniem do pamięci.
+
+Source = Union[str, np.ndarray, Iterable[np.ndarray]]
+
+
+def record_dtype(dtype: np.dtype) -> np.dtype:
+    return np.dtype([("x", dtype), ("y", dtype), ("row", np.int64)])
+
+
+class Chunks:
+    # Zbiór rekordów (współrzędne i numery wierszy) czytany partiami:
+    # widok na points.npy indeksu (korzeń) albo plik tymczasowy z podziału.
+    def __init__(self, dtype: np.dtype, path: Optional[str] = None, points: Optional[np.ndarray] = None):
+        self.coord_dtype = np.dtype(dtype)
+        self.dtype = record_dtype(dtype)
+        self.path = path
+        self.points = points
+        self.count = len(points) if points is not None else 0
+        self._file = open(path, "wb") if path is not None else None
+
+    def append(self, coords: np.ndarray, rows: np.ndarray) -> None:
+        if len(coords) == 0:
+            return
+        records = np.empty(len(coords), dtype=self.dtype)
+        records["x"], records["y"], records["row"] = coords[:, 0], coords[:, 1], rows
+        records.tofile(self._file)
+        self.count += len(coords)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _records(self) -> np.ndarray:
+        return np.memmap(self.path, dtype=self.dtype, mode="r", shape=(self.count,))
+
+    def chunks(self, chunk_size: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        for start in range(0, self.count, chunk_size):
+            stop = min(start + chunk_size, self.count)
+            if self.points is not None:
+                yield np.asarray(self.points[start:stop]), np.arange(start, stop, dtype=np.int64)
+            else:
+                records = np.array(self._records()[start:stop])
+                yield np.column_stack([records["x"], records["y"]]), records["row"]
+
+    def load(self) -> Tuple[np.ndarray, np.ndarray]:
+        return next(self.chunks(max(self.count, 1)), (np.empty((0, 2)), np.empty(0, dtype=np.int64)))
+
+    def sample(self, size: int, rng: np.random.Generator) -> np.ndarray:
+        ids = np.sort(rng.integers(0, self.count, min(size, self.count)))
+        if self.points is not None:
+            return np.asarray(self.points[ids])
+        records = self._records()[ids]
+        return np.column_stack([records["x"], records["y"]])
+
+    def remove(self) -> None:
+        self.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class IndexWriter:
+    # Tablice indeksu dopisywane na końcu plików surowych i zamieniane na
+    # .npy przy finish(). Pola węzłów znane dopiero po zbudowaniu poddrzew
+    # (np. prawe dziecko, koniec poddrzewa) są poprawiane przez patch().
+    def __init__(self, path: str, dtypes: Dict[str, Tuple[np.dtype, Tuple[int, ...]]]):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dtypes = dtypes
+        self.sizes = {name: 0 for name in dtypes}
+        self.files = {name: open(self._raw(name), "wb") for name in dtypes}
+        self.patches: Dict[str, List[Tuple[Any, Any]]] = {name: [] for name in dtypes}
+
+    def _raw(self, name: str) -> str:
+        return os.path.join(self.path, name + ".npy.part")
+
+    def append(self, name: str, values: np.ndarray) -> None:
+        dtype, shape = self.dtypes[name]
+        values = np.ascontiguousarray(values, dtype=dtype).reshape((-1,) + shape)
+        values.tofile(self.files[name])
+        self.sizes[name] += len(values)
+
+    def patch(self, name: str, index: Any, value: Any) -> None:
+        self.patches[name].append((index, value))
+
+    def finish(self) -> Dict[str, str]:
+        names = {}
+        for name, (dtype, shape) in self.dtypes.items():
+            self.files[name].close()
+            target = os.path.join(self.path, name + ".npy")
+            with open(target, "wb") as out, open(self._raw(name), "rb") as raw:
+                header = {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                          "fortran_order": False, "shape": (self.sizes[name],) + shape}
+                np.lib.format.write_array_header_1_0(out, header)
+                shutil.copyfileobj(raw, out, 1 << 24)
+            os.remove(self._raw(name))
+            if self.patches[name]:
+                array = np.load(target, mmap_mode="r+")
+                for index, value in self.patches[name]:
+                    array[index] = value
+                array.flush()
+                del array
+            names[name] = target
+        return names
+
+
+def copy_points(source: Source, path: str, chunk_size: int) -> np.ndarray:
+    # Kopia wejścia jako points.npy indeksu (numery wierszy wyników odnoszą
+    # się do niej). Zwraca tę kopię zmapowaną do pamięci.
+    os.makedirs(path, exist_ok=True)
+    target = os.path.join(path, "points.npy")
+    if isinstance(source, str):
+        source = np.load(source, mmap_mode="r")
+    if isinstance(source, np.ndarray):
+        if source.ndim != 2 or source.shape[1] != 2:
+            raise ValueError("Points array must be of shape (n_points, 2).")
+        out = np.lib.format.open_memmap(target, mode="w+", dtype=source.dtype, shape=source.shape)
+        for start in range(0, len(source), chunk_size):
+            out[start:start + chunk_size] = source[start:start + chunk_size]
+        out.flush()
+        del out
+    else:
+        writer, dtype = None, None
+        for chunk in source:
+            if not isinstance(chunk, np.ndarray):
+                raise TypeError("Points must be a NumPy ndarray.")
+            if chunk.ndim != 2 or chunk.shape[1] != 2:
+                raise ValueError("Points array must be of shape (n_points, 2).")
+            if writer is None:
+                dtype = chunk.dtype
+                writer = IndexWriter(path, {"points": (dtype, (2,))})
+            writer.append("points", chunk)
+        if writer is None:
+            raise ValueError("Points source is empty.")
+        writer.finish()
+    points = np.load(target, mmap_mode="r")
+    if len(points) == 0:
+        raise ValueError("Points source is empty.")
+    return points
+
+
+def bounds(points: np.ndarray, chunk_size: int) -> np.ndarray:
+    low = np.full(2, np.inf)
+    high = np.full(2, -np.inf)
+    for start in range(0, len(points), chunk_size):
+        chunk = np.asarray(points[start:start + chunk_size])
+        low = np.minimum(low, chunk.min(axis=0))
+        high = np.maximum(high, chunk.max(axis=0))
+    return np.concatenate([low, high])
+
+
+def cumulative_counts(path: str, chunk_size: int) -> None:
+    counts = np.load(os.path.join(path, "counts.npy"), mmap_mode="r")
+    out = np.lib.format.open_memmap(
+        os.path.join(path, "cum_counts.npy"), mode="w+", dtype=np.int64, shape=(len(counts) + 1,)
+    )
+    out[0] = 0
+    total = 0
+    for start in range(0, len(counts), chunk_size):
+        block = np.cumsum(counts[start:start + chunk_size], dtype=np.int64) + total
+        out[start + 1:start + 1 + len(block)] = block
+        total = int(block[-1])
+    out.flush()
+    del out
+
+
+def write_manifest(path: str, cls: type, params: dict, n_coords: int) -> None:
+    arrays = sorted(name[:-4] for name in os.listdir(path) if name.endswith(".npy"))
+    manifest = {
+        "format": FORMAT_VERSION,
+        "class": cls.__name__,
+        "params": params,
+        "parts": [[0, n_coords]],
+        "arrays": arrays,
+    }
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    # Skrót zawartości jak w save() - liczony z gotowego indeksu otwartego
+    # z mapowaniem, więc tablice są czytane strumieniowo.
+    manifest["fingerprint"] = cls.load(path, mmap=True).fingerprint()
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def bucket_size(memory_budget: int, bytes_per_point: int) -> int:
+    return max(memory_budget // bytes_per_point, 1024)
+
+
+def spill_directory(tmpdir: Optional[str]) -> str:
+    return tempfile.mkdtemp(prefix="spill-", dir=tmpdir)
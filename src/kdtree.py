@@ -1,11 +1,23 @@
+import os
+import shutil
+import sys
 import numpy as np
 from collections import defaultdict
-from typing import Optional, Generator, Tuple
+from typing import Any, Dict, Optional, Generator, Tuple, List
 from operator import itemgetter
 from .rectangle import Rectangle
-import sys
+from .batch import as_points, as_rectangles, bounding_box, csr_order, from_rectangle
+from .traversal import NearestBuffer, expand_ranges, kd_count, kd_disk, kd_nearest, kd_range
+from .duplicates import group_duplicates, regroup_rows
+from .dynamic import DynamicTree
+from .polygon import Polygon, kd_polygon
+from .parallel import run_tasks
+from .external import (
+    Chunks, IndexWriter, Source, bounds, bucket_size, copy_points, cumulative_counts,
+    spill_directory, write_manifest,
+)
+
 
-sys.setrecursionlimit(10**6)
 class Node:
     __slots__ = ["point", "left", "right", "count"]
 
@@ -27,74 +39,541 @@ class Node:
         return f"Node(point={self.point}, count={self.count})"
 
 
-class KdTree:
-    def __init__(self, points: np.ndarray):
+def build_layout(
+    points: np.ndarray, depth: int = 0, k: int = 2, workers: int = 1, leaf_size: int = 1
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    n = len(points)
+    index_dtype = np.int32 if n < np.iinfo(np.int32).max else np.int64
+    axes = np.empty(n, dtype=np.uint8)
+    left = np.full(n, -1, dtype=index_dtype)
+    right = np.full(n, -1, dtype=index_dtype)
+    ends = np.empty(n, dtype=index_dtype)
+    if n == 0:
+        return np.empty(0, dtype=np.intp), axes, left, right, ends
+
+    # Każda oś jest sortowana tylko raz. Segment [lo, hi) poddrzewa zajmuje te
+    # same pozycje na wszystkich listach i na każdej z nich pozostaje
+    # posortowany po swojej osi, więc mediana to zwykły odczyt pozycji, a podział
+    # to stabilne przestawienie indeksów - współrzędne nie są kopiowane.
+    # Wszystkie segmenty jednego poziomu są dzielone naraz.
+    by_axis = [np.argsort(points[:, axis], kind="stable") for axis in range(k)]
+    side = np.empty(n, dtype=np.int8)
+    lo = np.zeros(1, dtype=np.intp)
+    hi = np.full(1, n, dtype=np.intp)
+
+    while len(lo) > 0:
+        # Segment o co najwyżej leaf_size punktach zostaje liściem (kubełkiem)
+        # bez dzieci: jego punkty leżą w [lo, hi) w dowolnej kolejności i
+        # wszystkie mają koniec kubełka w ends.
+        leaf = hi - lo <= leaf_size
+        bucket_ends, members = expand_ranges(hi[leaf], lo[leaf], hi[leaf])
+        axes[members] = depth % k
+        ends[members] = bucket_ends
+        lo, hi = lo[~leaf], hi[~leaf]
+        if len(lo) == 0:
+            break
+
+        # Gdy segmentów jest co najmniej tyle, ile procesów, pozostałe poziomy
+        # budują procesy robocze - każdy segment to niezależne poddrzewo.
+        if workers > 1 and len(lo) >= workers:
+            _build_segments(points, by_axis[0], lo, hi, depth, k, axes, left, right, ends, workers, leaf_size)
+            break
+
+        axis = depth % k
+        sizes = hi - lo
+        starts = np.cumsum(sizes) - sizes
+        seg = np.repeat(np.arange(len(lo)), sizes)
+        pos = np.arange(sizes.sum()) - starts[seg] + lo[seg]
+
+        # Węzłem zostaje mediana segmentu. Punkty o współrzędnej równej medianie
+        # mogą trafić na obie strony, dlatego wyszukiwanie schodzi w prawo
+        # także przy równości - w zamian drzewo ma zawsze wysokość O(log n).
+        n_left = sizes // 2
+        n_right = sizes - n_left - 1
+        node_pos = lo + n_left
+
+        axes[lo] = axis
+        ends[lo] = hi
+        has_left = n_left > 0
+        has_right = n_right > 0
+        left[lo[has_left]] = lo[has_left] + 1
+        right[lo[has_right]] = (lo + 1 + n_left)[has_right]
+
+        # Na liście osi podziału wystarczy przesunąć medianę na początek
+        # segmentu; pozostałe listy są stabilnie dzielone na lewą i prawą część.
+        ids = by_axis[axis][pos]
+        node_seg = node_pos[seg]
+        before = pos < node_seg
+        side[ids] = np.where(before, 1, np.where(pos == node_seg, 0, 2))
+        by_axis[axis][np.where(before, pos + 1, np.where(pos == node_seg, lo[seg], pos))] = ids
+        for other in range(k):
+            if other == axis:
+                continue
+            ids = by_axis[other][pos]
+            sides = side[ids]
+            dest = lo[seg]
+            for value, first in ((1, lo + 1), (2, lo + 1 + n_left)):
+                mask = sides == value
+                rank = np.cumsum(mask)
+                rank -= (rank - mask)[starts][seg]
+                dest[mask] = (first[seg] + rank - 1)[mask]
+            by_axis[other][dest] = ids
+
+        lo, hi = (
+            np.stack([lo + 1, lo + 1 + n_left], axis=1).ravel(),
+            np.stack([lo + 1 + n_left, hi], axis=1).ravel(),
+        )
+        keep = hi > lo
+        lo, hi = lo[keep], hi[keep]
+        depth += 1
+
+    return by_axis[0], axes, left, right, ends
+
+
+def _layout_segment(
+    arrays: Dict[str, np.ndarray], lo: int, hi: int, depth: int, k: int, leaf_size: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # Posortowane numery punktów dają te same remisy co budowa sekwencyjna,
+    # więc drzewo nie zależy od liczby procesów.
+    ids = np.sort(arrays["order"][lo:hi])
+    order, axes, left, right, ends = build_layout(arrays["points"][ids], depth, k, leaf_size=leaf_size)
+    return ids[order], axes, left, right, ends
+
+
+def _build_segments(
+    points: np.ndarray,
+    order: np.ndarray,
+    lo: np.ndarray,
+    hi: np.ndarray,
+    depth: int,
+    k: int,
+    axes: np.ndarray,
+    left: np.ndarray,
+    right: np.ndarray,
+    ends: np.ndarray,
+    workers: int,
+    leaf_size: int,
+) -> None:
+    # Poddrzewo segmentu [l, h) ma własną numerację od zera; po przesunięciu
+    # o l trafia w to samo miejsce układu preorder całego drzewa.
+    tasks = [(l, h, depth, k, leaf_size) for l, h in zip(lo.tolist(), hi.tolist())]
+    results = run_tasks(_layout_segment, {"points": points, "order": order}, tasks, workers)
+    for (l, h, _, _, _), (ids, sub_axes, sub_left, sub_right, sub_ends) in zip(tasks, results):
+        order[l:h] = ids
+        axes[l:h] = sub_axes
+        left[l:h] = np.where(sub_left >= 0, sub_left + l, -1)
+        right[l:h] = np.where(sub_right >= 0, sub_right + l, -1)
+        ends[l:h] = sub_ends + l
+
+
+# Szacowane zużycie pamięci budowy w pamięci na jeden punkt (bajty).
+BUILD_BYTES_PER_POINT = 200
+# Domyślny rozmiar liścia wybrany przeglądem benchmark.py --leaf-sizes:
+# od ok. 16 punktów zysk na zapytaniach przestaje rosnąć.
+LEAF_SIZE = 16
+PIVOT_SAMPLE = 1 << 16
+
+
+def _external_layout(
+    source: Chunks,
+    depth: int,
+    k: int,
+    leaf_size: int,
+    writer: IndexWriter,
+    spill: str,
+    bucket: int,
+    chunk_size: int,
+    rng: np.random.Generator,
+) -> None:
+    index = writer.sizes["coords"]
+    if source.count <= bucket:
+        coords, rows = source.load()
+        unique_points, counts, first_rows, row_order = group_duplicates(coords)
+        order, axes, left, right, ends = build_layout(unique_points, depth, k, leaf_size=leaf_size)
+        first_rows, counts = first_rows[order], counts[order]
+        writer.append("coords", unique_points[order])
+        writer.append("counts", counts)
+        writer.append("rows", rows[first_rows])
+        writer.append("row_order", rows[regroup_rows(row_order, first_rows, counts)])
+        writer.append("part0_axes", axes)
+        writer.append("part0_left", np.where(left >= 0, left + index, -1))
+        writer.append("part0_right", np.where(right >= 0, right + index, -1))
+        writer.append("part0_ends", ends + index)
+        return
+
+    # Węzeł zewnętrzny: mediana leksykograficzna (oś podziału, druga oś)
+    # z próbki punktów. Punkty mniejsze idą w lewo, większe w prawo, a kopie
+    # osi są węzłem - po obu stronach współrzędna na osi jest odpowiednio
+    # <= i >= od podziału, tak jak w build_layout.
+    axis = depth % k
+    other = 1 - axis
+    sample = source.sample(PIVOT_SAMPLE, rng)
+    pivot = sample[np.lexsort((sample[:, other], sample[:, axis]))[len(sample) // 2]]
+    sides = [Chunks(source.coord_dtype, os.path.join(spill, f"{index}-{side}.bin")) for side in ("left", "right")]
+    count, first_row = 0, -1
+    for coords, rows in source.chunks(chunk_size):
+        a, b = coords[:, axis], coords[:, other]
+        less = (a < pivot[axis]) | ((a == pivot[axis]) & (b < pivot[other]))
+        equal = (a == pivot[axis]) & (b == pivot[other])
+        sides[0].append(coords[less], rows[less])
+        sides[1].append(coords[~less & ~equal], rows[~less & ~equal])
+        writer.append("row_order", rows[equal])
+        if first_row < 0 and np.any(equal):
+            first_row = int(rows[equal][0])
+        count += int(np.count_nonzero(equal))
+    source.remove()
+
+    writer.append("coords", pivot[None])
+    writer.append("counts", [count])
+    writer.append("rows", [first_row])
+    writer.append("part0_axes", [axis])
+    for name in ("part0_left", "part0_right", "part0_ends"):
+        writer.append(name, [-1])
+    for side, name in zip(sides, ("part0_left", "part0_right")):
+        side.close()
+        if side.count > 0:
+            writer.patch(name, index, writer.sizes["coords"])
+            _external_layout(side, depth + 1, k, leaf_size, writer, spill, bucket, chunk_size, rng)
+        side.remove()
+    writer.patch("part0_ends", index, writer.sizes["coords"])
+
+
+class FlatKdTree(DynamicTree):
+    def __init__(
+        self, points: np.ndarray, workers: int = 1, leaf_size: int = LEAF_SIZE, dtype: Optional[np.dtype] = None
+    ):
         if not isinstance(points, np.ndarray):
             raise TypeError("Points must be a NumPy ndarray.")
         if points.ndim != 2 or points.shape[1] != 2:
             raise ValueError("Points array must be of shape (n_points, 2).")
+        if leaf_size < 1:
+            raise ValueError("leaf_size must be a positive integer.")
         self.k = 2
+        self.leaf_size = leaf_size
         self.points = points
-        self.counts = self._count_duplicates()
-        unique_points = np.array(list(self.counts.keys()))
-        self.root = self.build(unique_points)
+        unique_points, counts, first_rows, row_order = group_duplicates(points)
+        stored = self._quantize(dtype, unique_points)
 
-    def _count_duplicates(self) -> defaultdict:
-        counts = defaultdict(int)
-        for point in self.points:
-            key = tuple(point)
-            counts[key] += 1
-        return counts
+        # Węzły zapisane w kolejności preorder: lewe poddrzewo węzła i zaczyna
+        # się w i + 1, prawe w self.right[i]; -1 oznacza brak dziecka. Całe
+        # poddrzewo węzła i zajmuje przedział [i, self.ends[i]). Liście to
+        # kubełki do leaf_size punktów sprawdzanych razem (patrz kd_points).
+        order, self.axes, self.left, self.right, self.ends = build_layout(
+            stored, 0, self.k, workers, leaf_size
+        )
+        self.coords = stored[order]
+        counts = counts[order].astype(np.int64)
+        self.cum_counts = np.concatenate([[0], np.cumsum(counts)])
+        self.rows = first_rows[order]
+        # Wiersze wejścia pogrupowane według węzłów: wiersze punktu z węzła i
+        # to row_order[cum_counts[i]:cum_counts[i + 1]] (po zmianach grupa
+        # zaczyna się w row_start[i], patrz DynamicTree).
+        self.row_order = regroup_rows(row_order, self.rows, counts)
+        self.bbox = bounding_box(self.coords)
+        self._init_parts((self.axes, self.left, self.right, self.ends, self.bbox))
 
-    def build(self, points: np.ndarray, depth: int = 0) -> Optional[Node]:
-        if len(points) == 0:
-            return None
+    @classmethod
+    def build_external(
+        cls,
+        source: Source,
+        path: str,
+        leaf_size: int = LEAF_SIZE,
+        memory_budget: int = 1 << 30,
+        chunk_size: int = 1 << 20,
+        tmpdir: Optional[str] = None,
+    ) -> "FlatKdTree":
+        # Budowa poza pamięcią z pliku .npy, tablicy (także mapowanej) albo
+        # iteratora partii; indeks trafia do katalogu path i jest otwierany
+        # przez load(). Części większe niż memory_budget są dzielone na
+        # plikach tymczasowych w tmpdir.
+        points = copy_points(source, path, chunk_size)
+        bucket = bucket_size(memory_budget, BUILD_BYTES_PER_POINT)
+        chunk_size = min(chunk_size, bucket)
+        index_dtype = np.int32 if len(points) < np.iinfo(np.int32).max else np.int64
+        writer = IndexWriter(path, {
+            "coords": (points.dtype, (2,)),
+            "counts": (np.int64, ()),
+            "rows": (np.intp, ()),
+            "row_order": (np.intp, ()),
+            "part0_axes": (np.uint8, ()),
+            "part0_left": (index_dtype, ()),
+            "part0_right": (index_dtype, ()),
+            "part0_ends": (index_dtype, ()),
+        })
+        spill = spill_directory(tmpdir)
+        try:
+            _external_layout(
+                Chunks(points.dtype, points=points), 0, 2, leaf_size, writer, spill, bucket,
+                chunk_size, np.random.default_rng(0),
+            )
+            n_coords = writer.sizes["coords"]
+            writer.finish()
+        finally:
+            shutil.rmtree(spill, ignore_errors=True)
+        cumulative_counts(path, chunk_size)
+        np.save(os.path.join(path, "part0_bbox.npy"), bounds(points, chunk_size))
+        del points
+        write_manifest(path, cls, {"k": 2, "leaf_size": leaf_size}, n_coords)
+        return cls.load(path, mmap=True)
 
-        axis = depth % self.k
-        idxs = points[:, axis].argsort()
-        points = points[idxs]
+    def search_rectangle(self, rectangle: Rectangle) -> Generator[Node, None, None]:
+        return self._emit(self._search(rectangle))
 
-        median_idx = len(points) // 2
-        median_point = tuple(points[median_idx])
-        median_coord = points[median_idx, axis]
+    def search_radius(self, center: Tuple[float, float], radius: float) -> Generator[Node, None, None]:
+        return self._emit(self._search_radius(center, radius))
 
-        indices = np.arange(len(points))
-        mask_left = (points[:, axis] < median_coord) | (
-            (points[:, axis] == median_coord) & (indices != median_idx)
-        )
-        left_points = points[mask_left]
+    def search_polygon(self, vertices: np.ndarray) -> Generator[Node, None, None]:
+        return self._emit(self._search_polygon(vertices))
 
-        right_points = points[points[:, axis] > median_coord]
+    def _emit(self, hits: np.ndarray) -> Generator[Node, None, None]:
+        for point, count in zip(self._original(hits).tolist(), self._weights(hits).tolist()):
+            yield Node(point=tuple(point), count=count)
 
-        left_child = self.build(left_points, depth + 1)
-        right_child = self.build(right_points, depth + 1)
+    def _search(self, rectangle: Rectangle) -> np.ndarray:
+        return self._range(from_rectangle(rectangle))[1]
 
-        return Node(
-            point=median_point,
-            count=self.counts[median_point],
-            left=left_child,
-            right=right_child,
-        )
+    def query_many(self, rects: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        rects = as_rectangles(rects)
+        queries, hits = self._range(rects)
+        offsets, order = csr_order(len(rects), queries)
+        hits = hits[order]
+        return offsets, self.rows[hits], self._weights(hits)
 
-    def search_rectangle(self, rectangle: Rectangle) -> Generator[Node, None, None]:
-        yield from self._search_rectangle(rectangle, self.root, 0)
+    def count_rectangle(self, rectangle: Rectangle) -> int:
+        return int(self.count_many(from_rectangle(rectangle))[0])
+
+    def nearest(self, point: Tuple[float, float], k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        distances, indices = self.nearest_many(np.array([point], dtype=np.float64), k)
+        return distances[0], indices[0]
+
+    def nearest_many(self, points: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        points = as_points(points).astype(np.float64)
+        if k < 1:
+            raise ValueError("k must be a positive integer.")
+        best = self._nearest(points, k)
+
+        # Punkt o krotności c zajmuje do c kolejnych miejsc wyniku, każde z
+        # innym wierszem wejścia (kolejne wiersze z row_order).
+        query = np.repeat(np.arange(len(points)), k)
+        pos, weight = best.pos.ravel(), best.weight.ravel()
+        taken = np.cumsum(weight.reshape(-1, k), axis=1).ravel() - weight
+        take = np.minimum(weight, np.maximum(k - taken, 0))
+        # Puste miejsca (pos -1, także w pustym drzewie) nie biorą wierszy.
+        first = np.zeros(len(pos), dtype=np.int64)
+        first[take > 0] = self.row_start[pos[take > 0]]
+        query, idx = expand_ranges(query, first, first + take)
+        slot = np.arange(len(query)) - np.searchsorted(query, query)
+
+        distances = np.full((len(points), k), np.inf)
+        indices = np.full((len(points), k), -1, dtype=np.intp)
+        distances[query, slot] = np.sqrt(np.repeat(best.dist.ravel(), take))
+        indices[query, slot] = self.row_order[idx]
+        return distances, indices
+
+    def _nearest(self, points: np.ndarray, k: int) -> NearestBuffer:
+        queries = points if self.quantizer is None else self.quantizer.affine(points)
+        best = NearestBuffer(len(points), k)
+        for start, stop, (axes, left, right, ends, bbox) in self.parts:
+            kd_nearest(
+                self.coords[start:stop], axes, left, right, ends,
+                self.cum_counts[start:stop + 1], bbox, queries, best, start,
+            )
+        if self.quantizer is None:
+            return best
+
+        # Przy zmniejszonej precyzji odległości różnią się od prawdziwych o
+        # co najwyżej przesunięcie punktu e, więc prawdziwi sąsiedzi leżą w
+        # promieniu d_k + 2e od zapytania (d_k - k-ta odległość przybliżona).
+        # Kandydaci z tego okręgu są porządkowani po prawdziwych odległościach.
+        circles = self.quantizer.widen(queries, np.sqrt(best.bound()) + self.quantizer.error * np.sqrt(2))
+        (cq, clo, chi), (q, h) = self._disk(circles)
+        cq, ch = expand_ranges(cq, clo, chi)
+        query, pos = np.concatenate([cq, q]), np.concatenate([ch, h])
+        weight = self.cum_counts[pos + 1] - self.cum_counts[pos]
+        live = weight > 0
+        query, pos, weight = query[live], pos[live], weight[live]
+        best = NearestBuffer(len(points), k)
+        best.push(query, ((self._original(pos) - points[query]) ** 2).sum(axis=1), pos, weight)
+        return best
+
+    def _part_range(self, part: Any, coords: np.ndarray, rects: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        axes, left, right, ends, _ = part
+        return kd_range(coords, axes, left, right, ends, rects)
+
+    def _part_count(
+        self, part: Any, coords: np.ndarray, cum_counts: np.ndarray, rects: np.ndarray
+    ) -> np.ndarray:
+        axes, left, right, ends, bbox = part
+        return kd_count(coords, axes, left, right, ends, cum_counts, bbox, rects)
+
+    def _part_disk(
+        self, part: Any, coords: np.ndarray, circles: np.ndarray
+    ) -> Tuple[Tuple[np.ndarray, np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray]]:
+        axes, left, right, ends, bbox = part
+        return kd_disk(coords, axes, left, right, ends, bbox, circles)
+
+    def _part_polygon(
+        self, part: Any, coords: np.ndarray, polygon: Polygon
+    ) -> Tuple[Tuple[np.ndarray, np.ndarray], np.ndarray]:
+        axes, left, right, ends, bbox = part
+        return kd_polygon(coords, axes, left, right, ends, bbox, polygon)
+
+    def _build_part(self, coords: np.ndarray) -> Tuple[np.ndarray, Any]:
+        order, axes, left, right, ends = build_layout(coords, 0, self.k, leaf_size=self.leaf_size)
+        return order, (axes, left, right, ends, bounding_box(coords))
+
+    def _params(self) -> dict:
+        return {"k": self.k, "leaf_size": self.leaf_size}
+
+    def _restore(self, params: dict) -> None:
+        self.k = params["k"]
+        self.leaf_size = params["leaf_size"]
+
+    def _part_arrays(self, part: Any) -> Dict[str, np.ndarray]:
+        return dict(zip(("axes", "left", "right", "ends", "bbox"), part))
+
+    def _part_from_arrays(self, arrays: Dict[str, np.ndarray]) -> Any:
+        return tuple(arrays[name] for name in ("axes", "left", "right", "ends", "bbox"))
+
+    def _assign(
+        self, coords: np.ndarray, rows: np.ndarray, row_order: np.ndarray,
+        cum_counts: np.ndarray, main: Optional[Any] = None,
+    ) -> None:
+        if main is not None:
+            self.axes, self.left, self.right, self.ends, self.bbox = main
+        self.coords = coords
+        self.cum_counts = cum_counts
+        self.rows = rows
+        self.row_order = row_order
 
-    def _search_rectangle(
-        self, rectangle: Rectangle, node: Optional[Node], depth: int
-    ) -> Generator[Node, None, None]:
-        if node is None:
+
+class KdTree(FlatKdTree):
+    def __init__(
+        self, points: np.ndarray, workers: int = 1, leaf_size: int = LEAF_SIZE, dtype: Optional[np.dtype] = None
+    ):
+        super().__init__(points, workers, leaf_size, dtype)
+        self._counts = None
+        self._nodes = None
+
+    # Słownik krotności i obiekty Node powstają dopiero przy pierwszym użyciu,
+    # więc drzewo wczytane z dysku nie płaci za nie przy otwieraniu.
+    @property
+    def counts(self) -> defaultdict:
+        if self._counts is None:
+            self._counts = self._count_duplicates()
+        return self._counts
+
+    @property
+    def nodes(self) -> List[Node]:
+        if self._nodes is None:
+            n_main = self.parts[0][1]
+            self._nodes = self._link(
+                self._original(np.arange(n_main)), np.diff(self.cum_counts[:n_main + 1]),
+                self.left, self.right, self.ends,
+            )
+        return self._nodes
+
+    @property
+    def root(self) -> Optional[Node]:
+        return self.nodes[0] if self.nodes else None
+
+    def _count_duplicates(self) -> defaultdict:
+        counts = np.diff(self.cum_counts)
+        live = np.flatnonzero(counts > 0)
+        return defaultdict(int, zip(map(tuple, self._original(live).tolist()), counts[live].tolist()))
+
+    def insert(self, points: np.ndarray) -> None:
+        super().insert(points)
+        self._sync_counts(points)
+
+    def delete(self, points: np.ndarray) -> int:
+        deleted = super().delete(points)
+        self._sync_counts(points)
+        return deleted
+
+    def _sync_counts(self, points: np.ndarray) -> None:
+        # Słownik krotności i węzły drzewa głównego są poprawiane tylko dla
+        # punktów, których dotyczyła zmiana, i tylko gdy już powstały; same
+        # węzły wymagają szukania tylko w drzewie głównym.
+        if self._counts is None and self._nodes is None:
             return
+        unique_points = np.unique(points, axis=0)
+        positions = self._locate(unique_points, main_only=self._counts is None)
+        counts = np.where(positions >= 0, self._weights(np.maximum(positions, 0)), 0)
+        if self._nodes is not None:
+            main = np.flatnonzero((positions >= 0) & (positions < len(self._nodes)))
+            for i, count in zip(positions[main].tolist(), counts[main].tolist()):
+                self._nodes[i].count = count
+        if self._counts is not None:
+            for point, count in zip(map(tuple, unique_points.tolist()), counts.tolist()):
+                if count:
+                    self._counts[point] = count
+                else:
+                    self._counts.pop(point, None)
+
+    def _restore(self, params: dict) -> None:
+        super()._restore(params)
+        self._counts = None
+        self._nodes = None
 
-        if rectangle.contains(node.point):
-            yield node
+    def _object_bytes(self) -> Dict[str, int]:
+        report = {}
+        if self._nodes is not None:
+            report["nodes"] = sys.getsizeof(self._nodes) + sum(
+                sys.getsizeof(node) + sys.getsizeof(node.point) + sum(map(sys.getsizeof, node.point))
+                for node in self._nodes
+            )
+        if self._counts is not None:
+            report["counts_dict"] = sys.getsizeof(self._counts) + sum(
+                sys.getsizeof(point) + sum(map(sys.getsizeof, point)) for point in self._counts
+            )
+        return report
 
-        axis = depth % self.k
-        coord = node.point[axis]
+    def _assign(
+        self, coords: np.ndarray, rows: np.ndarray, row_order: np.ndarray,
+        cum_counts: np.ndarray, main: Optional[Any] = None,
+    ) -> None:
+        super()._assign(coords, rows, row_order, cum_counts, main)
+        if main is not None:
+            self._nodes = None
 
-        if rectangle.extreme[axis][0] <= coord:
-            yield from self._search_rectangle(rectangle, node.left, depth + 1)
-        if rectangle.extreme[axis][1] > coord:
-            yield from self._search_rectangle(rectangle, node.right, depth + 1)
+    def build(self, points: np.ndarray, depth: int = 0) -> Optional[Node]:
+        order, _, left, right, ends = build_layout(points, depth, self.k)
+        points = points[order]
+        counts = np.array([self.counts[tuple(point)] for point in points.tolist()])
+        nodes = self._link(points, counts, left, right, ends)
+        return nodes[0] if nodes else None
+
+    def _link(
+        self, points: np.ndarray, counts: np.ndarray, left: np.ndarray, right: np.ndarray, ends: np.ndarray
+    ) -> List[Node]:
+        nodes = [
+            Node(point=tuple(point), count=count)
+            for point, count in zip(points.tolist(), counts.tolist())
+        ]
+        # Punkty kubełka (leaf_size > 1) nie mają podziału - są łączone w
+        # łańcuch przez left, tak by każdy był osiągalny z korzenia.
+        for i, (node, l, r, end) in enumerate(zip(nodes, left.tolist(), right.tolist(), ends.tolist())):
+            if l >= 0:
+                node.left = nodes[l]
+            elif r < 0 and end > i + 1:
+                node.left = nodes[i + 1]
+            if r >= 0:
+                node.right = nodes[r]
+        return nodes
+
+    def _emit(self, hits: np.ndarray) -> Generator[Node, None, None]:
+        # Punkty dodane po budowie leżą w drzewach pomocniczych, które nie mają
+        # obiektów Node - dla nich (i zanim obiekty Node w ogóle powstaną)
+        # węzły są tworzone na bieżąco.
+        if self._nodes is None:
+            yield from super()._emit(hits)
+            return
+        for i in hits.tolist():
+            if i < len(self._nodes):
+                yield self._nodes[i]
+            else:
+                yield Node(point=tuple(self._original(np.array([i]))[0].tolist()), count=int(self._weights(i)))
 
 
 # def main():
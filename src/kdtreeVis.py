@@ -3,6 +3,7 @@ from collections import defaultdict
 from typing import Optional, List, Tuple, Generator
 from .visualizer.main import Visualizer
 from .rectangle import Rectangle
+from .duplicates import group_duplicates
 
 class Node:
     __slots__ = ["point", "left", "right", "count"]
@@ -45,11 +46,8 @@ class KdTreeVis:
         self.root = self.build(unique_points, self.boundary)
 
     def _count_duplicates(self) -> defaultdict:
-        counts = defaultdict(int)
-        for point in self.points:
-            key = tuple(point)
-            counts[key] += 1
-        return counts
+        unique_points, counts, _, _ = group_duplicates(self.points)
+        return defaultdict(int, zip(map(tuple, unique_points), counts.tolist()))
 
     def _calculate_boundary(self, points: np.ndarray) -> Rectangle:
         xmin, ymin = points.min(axis=0)
@@ -0,0 +1,173 @@
+import numpy as np
+from typing import Dict, Generator, Tuple
+from .rectangle import Rectangle
+from .batch import as_rectangles, bounding_box, csr_order, from_rectangle
+from .duplicates import group_duplicates, regroup_rows
+from .traversal import HitBuffer, expand_ranges
+
+BITS = 31
+
+
+def spread_bits(values: np.ndarray) -> np.ndarray:
+    v = values.astype(np.uint64)
+    for shift, mask in (
+        (16, 0x0000FFFF0000FFFF),
+        (8, 0x00FF00FF00FF00FF),
+        (4, 0x0F0F0F0F0F0F0F0F),
+        (2, 0x3333333333333333),
+        (1, 0x5555555555555555),
+    ):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+def morton_encode(ix: np.ndarray, iy: np.ndarray) -> np.ndarray:
+    return spread_bits(ix) | (spread_bits(iy) << np.uint64(1))
+
+
+class LinearQuadTree:
+    def __init__(self, points: np.ndarray, max_capacity: int = 4):
+        if not isinstance(points, np.ndarray):
+            raise TypeError("Points must be a NumPy ndarray.")
+        if points.ndim != 2 or points.shape[1] != 2:
+            raise ValueError("Points array must be of shape (n_points, 2).")
+
+        self.points = points
+        self.max_capacity = max_capacity
+
+        # Punkty są rzutowane na siatkę 2^BITS x 2^BITS rozpiętą na prostokącie
+        # danych i sortowane po kodzie Mortona. Węzeł drzewa to prefiks kodu,
+        # a jego punkty to przedział tablicy codes znajdowany wyszukiwaniem
+        # binarnym - struktura nie ma żadnych wskaźników.
+        unique_points, counts, first_rows, row_order = group_duplicates(points)
+        self.bbox = bounding_box(unique_points)
+        extent = self.bbox[2:] - self.bbox[:2]
+        self.scale = np.zeros(2)
+        np.divide(2.0 ** BITS - 1, extent, out=self.scale, where=extent > 0)
+
+        cells = np.floor(self._to_grid(unique_points)).astype(np.uint64)
+        codes = morton_encode(cells[:, 0], cells[:, 1])
+        order = np.argsort(codes, kind="stable")
+
+        self.codes = codes[order]
+        self.coords = unique_points[order]
+        self.counts = counts[order]
+        self.cum_counts = np.concatenate([[0], np.cumsum(self.counts)])
+        self.rows = first_rows[order]
+        self.row_order = regroup_rows(row_order, self.rows, self.counts)
+
+    def _to_grid(self, coords: np.ndarray) -> np.ndarray:
+        return (coords - self.bbox[:2]) * self.scale
+
+    def _intervals(
+        self, rects: np.ndarray
+    ) -> Tuple[Tuple[np.ndarray, np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        # Rozkład prostokątów na przedziały krzywej Z. Komórki siatki ściśle
+        # wewnątrz zapytania (bez pierwszego i ostatniego wiersza/kolumny) na
+        # pewno zawierają tylko trafienia - ich przedziały są "pokryte".
+        # Przedziały z brzegu są kandydatami i wymagają dokładnego testu.
+        limit = 2.0 ** BITS - 1
+        lower = np.clip(np.floor(self._to_grid(rects[:, :2])), -1, limit + 1)
+        upper = np.clip(np.floor(self._to_grid(rects[:, 2:])), -1, limit + 1)
+
+        # Każde zapytanie zaczyna od najmniejszej komórki, która mieści
+        # wszystkie jego komórki siatki, zamiast schodzić od korzenia.
+        query = np.flatnonzero(np.all((upper >= 0) & (lower <= limit), axis=1))
+        if len(self.codes) == 0:
+            query = query[:0]
+        first_cell = np.clip(lower[query], 0, limit).astype(np.uint64)
+        last_cell = np.clip(upper[query], 0, limit).astype(np.uint64)
+        shift = np.frexp((first_cell ^ last_cell).astype(np.float64))[1].max(axis=1, initial=0)
+        cell = first_cell >> shift[:, None].astype(np.uint64)
+
+        covered, candidates = ([], [], []), ([], [], [])
+        while len(query) > 0:
+            first = (cell << shift[:, None].astype(np.uint64)).astype(np.float64)
+            last = first + (2.0 ** shift[:, None] - 1)
+            low, high = lower[query], upper[query]
+            keep = np.all((last >= low) & (first <= high), axis=1)
+            cell, query, shift, first, last, low, high = (
+                cell[keep], query[keep], shift[keep], first[keep], last[keep], low[keep], high[keep]
+            )
+
+            span = (2 * shift).astype(np.uint64)
+            prefix = morton_encode(cell[:, 0], cell[:, 1]) << span
+            lo = np.searchsorted(self.codes, prefix)
+            hi = np.searchsorted(self.codes, prefix + (np.uint64(1) << span))
+
+            inner = np.all((first > low) & (last < high), axis=1)
+            small = (hi - lo <= self.max_capacity) | (shift == 0)
+            for target, mask in ((covered, inner), (candidates, small & ~inner)):
+                mask = mask & (hi > lo)
+                target[0].append(query[mask])
+                target[1].append(lo[mask])
+                target[2].append(hi[mask])
+
+            split = ~(inner | small) & (hi > lo)
+            cell, query, shift = cell[split] * np.uint64(2), query[split], shift[split] - 1
+            cell = np.concatenate([
+                cell + np.array(d, dtype=np.uint64) for d in ((0, 0), (1, 0), (0, 1), (1, 1))
+            ])
+            query, shift = np.tile(query, 4), np.tile(shift, 4)
+
+        return (
+            tuple(np.concatenate(part) if part else np.empty(0, dtype=np.intp) for part in covered),
+            tuple(np.concatenate(part) if part else np.empty(0, dtype=np.intp) for part in candidates),
+        )
+
+    def _range(self, rects: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        (cq, clo, chi), (q, lo, hi) = self._intervals(rects)
+        out = HitBuffer(len(self.coords))
+        out.extend(*expand_ranges(cq, clo, chi))
+        q, pos = expand_ranges(q, lo, hi)
+        p, r = self.coords[pos], rects[q]
+        inside = (
+            (r[:, 0] <= p[:, 0]) & (p[:, 0] <= r[:, 2])
+            & (r[:, 1] <= p[:, 1]) & (p[:, 1] <= r[:, 3])
+        )
+        out.extend(q[inside], pos[inside])
+        return out.result()
+
+    def _search(self, rectangle: Rectangle) -> np.ndarray:
+        return np.sort(self._range(from_rectangle(rectangle))[1])
+
+    def search_rectangle(self, rectangle: Rectangle) -> Generator[Tuple[float, float], None, None]:
+        for x, y in self.coords[self._search(rectangle)].tolist():
+            yield (x, y)
+
+    def search_rectangle_with_count(self, rectangle: Rectangle) -> Generator[Tuple[Tuple[float, float], int], None, None]:
+        hits = self._search(rectangle)
+        for (x, y), count in zip(self.coords[hits].tolist(), self.counts[hits].tolist()):
+            yield ((x, y), count)
+
+    def query_many(self, rects: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        rects = as_rectangles(rects)
+        queries, hits = self._range(rects)
+        offsets, order = csr_order(len(rects), queries)
+        hits = hits[order]
+        return offsets, self.rows[hits], self.counts[hits]
+
+    def count_rectangle(self, rectangle: Rectangle) -> int:
+        return int(self.count_many(from_rectangle(rectangle))[0])
+
+    def count_many(self, rects: np.ndarray) -> np.ndarray:
+        rects = as_rectangles(rects)
+        (cq, clo, chi), (q, lo, hi) = self._intervals(rects)
+        totals = np.zeros(len(rects), dtype=np.int64)
+        totals += np.bincount(
+            cq, self.cum_counts[chi] - self.cum_counts[clo], minlength=len(rects)
+        ).astype(np.int64)
+        q, pos = expand_ranges(q, lo, hi)
+        p, r = self.coords[pos], rects[q]
+        inside = (
+            (r[:, 0] <= p[:, 0]) & (p[:, 0] <= r[:, 2])
+            & (r[:, 1] <= p[:, 1]) & (p[:, 1] <= r[:, 3])
+        )
+        totals += np.bincount(q[inside], self.counts[pos[inside]], minlength=len(rects)).astype(np.int64)
+        return totals
+
+    def memory_report(self) -> Dict[str, int]:
+        return {name: int(values.nbytes) for name, values in vars(self).items() if isinstance(values, np.ndarray)}
+
+    def nbytes(self) -> int:
+        return sum(self.memory_report().values())
@@ -0,0 +1,44 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List
+
+
+# Równoległa budowa: górne poziomy drzewa dzieli proces główny, a niezależne
+# poddrzewa budują procesy robocze. Duże tablice wejściowe trafiają do pamięci
+# współdzielonej raz - zadanie to tylko kilka liczb, a każdy proces widzi te
+# same strony zamiast kopii przesłanej przez potok.
+
+def _run(fn: Callable, specs: Dict[str, tuple], task: tuple) -> Any:
+    blocks, arrays = [], {}
+    try:
+        for name, (block_name, shape, dtype) in specs.items():
+            block = shared_memory.SharedMemory(name=block_name)
+            blocks.append(block)
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        return fn(arrays, *task)
+    finally:
+        arrays.clear()
+        for block in blocks:
+            block.close()
+
+
+def run_tasks(
+    fn: Callable, shared: Dict[str, np.ndarray], tasks: List[tuple], workers: int
+) -> List[Any]:
+    # fn(arrays, *task) musi być funkcją modułu (wysyłaną przez pickle) i
+    # zwracać kopie danych, nie widoki na tablice współdzielone.
+    blocks, specs = [], {}
+    try:
+        for name, values in shared.items():
+            values = np.ascontiguousarray(values)
+            block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            blocks.append(block)
+            np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)[...] = values
+            specs[name] = (block.name, values.shape, values.dtype.str)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(_run, [fn] * len(tasks), [specs] * len(tasks), tasks))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
@@ -0,0 +1,305 @@
+import time
+import numpy as np
+from typing import Dict, Generator, List, Optional, Tuple
+from .rectangle import Rectangle
+from .batch import as_rectangles, from_rectangle
+from .kdtree import KdTree
+from .Quadtree import QuadTree
+
+ENGINES = ("scan", "kdtree", "quadtree")
+FEATURES = ("query", "point", "hit", "boundary")
+
+# Koszt prostokąta w zapytaniu wsadowym to suma współczynnik * cecha (w
+# sekundach), gdzie cechy to: stały narzut, liczba wszystkich punktów,
+# szacowana liczba trafień i szacowana liczba punktów przy brzegu prostokąta.
+# Wartości zmierzone na rozkładach z testmanager.py - tylko punkt startowy:
+# calibrate() dopasowuje je do maszyny i rozkładu danych, bo o tym, czy
+# wygrywa KdTree czy QuadTree, decyduje właśnie rozkład.
+DEFAULT_COSTS: Dict[str, Dict[str, float]] = {
+    "scan": {"query": 0.0, "point": 9e-9, "hit": 3.5e-8, "boundary": 0.0},
+    "kdtree": {"query": 5e-5, "point": 0.0, "hit": 2.8e-7, "boundary": 5e-8},
+    "quadtree": {"query": 4e-5, "point": 0.0, "hit": 8e-8, "boundary": 5e-8},
+}
+
+
+class QueryPlanner:
+    # Fasada nad KdTree, QuadTree i pełnym przeglądem tablicy punktów. Dla
+    # każdego prostokąta szacuje liczbę trafień z liczników poddrzew QuadTree
+    # i kieruje go do silnika o najmniejszym szacowanym koszcie. Statystyki
+    # są liczone przy budowie - planer nie obsługuje insert/delete.
+    # Dopasowanie kosztów (calibrate) i zwalnianie silników (prune) są
+    # osobnymi, jawnymi wywołaniami - domyślnie dostępne są wszystkie.
+    def __init__(
+        self,
+        points: np.ndarray,
+        max_capacity: int = 4,
+        workers: int = 1,
+        stats_cells: int = 4096,
+        grid_size: int = 64,
+        costs: Optional[Dict[str, Dict[str, float]]] = None,
+    ):
+        self.kdtree: Optional[KdTree] = KdTree(points, workers)
+        self.quadtree: Optional[QuadTree] = QuadTree(points, max_capacity, workers)
+        self.points = points
+        self.engines = ENGINES
+        self.costs = {engine: dict(DEFAULT_COSTS[engine]) for engine in ENGINES}
+        for engine, values in (costs or {}).items():
+            self.costs[engine].update(values)
+
+        # Komórki statystyk: najgłębszy poziom QuadTree (liście płytszych
+        # gałęzi zostają), na którym komórek jest nie więcej niż stats_cells.
+        # Liczba punktów komórki to różnica sum krotności jej przedziału.
+        tree = self.quadtree
+        frontier = np.zeros(1 if len(tree.bounds) > 0 else 0, dtype=np.intp)
+        while len(frontier) > 0:
+            children = tree.children[frontier]
+            leaf = children[:, 0] < 0
+            expanded = np.concatenate([frontier[leaf], children[~leaf][children[~leaf] >= 0]])
+            if np.all(leaf) or len(expanded) > stats_cells:
+                break
+            frontier = expanded
+        cells = tree.bounds[frontier]
+        cell_counts = (tree.cum_counts[tree.hi[frontier]] - tree.cum_counts[tree.lo[frontier]]).astype(np.float64)
+
+        # Liczniki komórek rozłożone na siatkę grid_size x grid_size
+        # proporcjonalnie do pola (punkty równomiernie w komórce) i zapisane
+        # jako tablica sum prefiksowych - oszacowanie dla prostokąta to
+        # cztery odczyty niezależnie od liczby komórek.
+        self.grid_size = grid_size
+        self.origin = cells[:, :2].min(axis=0) if len(cells) > 0 else np.zeros(2)
+        extent = cells[:, 2:].max(axis=0) - self.origin if len(cells) > 0 else np.zeros(2)
+        self.step = extent / grid_size
+        weights = [self._spread(cells[:, axis], cells[:, axis + 2], axis) for axis in (0, 1)]
+        self.prefix = np.zeros((grid_size + 1, grid_size + 1))
+        self.prefix[1:, 1:] = np.cumsum(np.cumsum((weights[0] * cell_counts[:, None]).T @ weights[1], axis=0), axis=1)
+
+        # Przegląd działa na unikalnych punktach (pierwszy wiersz i krotność
+        # każdego, jak w wynikach drzew) - kopia niezależna od KdTree.
+        counts = np.diff(self.kdtree.cum_counts)
+        live = np.flatnonzero(counts > 0)
+        self._live_coords = np.ascontiguousarray(self.kdtree.coords[live])
+        self._live_rows = self.kdtree.rows[live]
+        self._live_counts = counts[live]
+
+    def sample_rectangles(self, count: int, seed: int = 0) -> np.ndarray:
+        # Prostokąty o środkach w losowych punktach danych i polu od 1e-6 do
+        # całości obwiedni (rozkład logarytmiczny) - mieszane selektywności.
+        if len(self.points) == 0 or count < 1:
+            return np.empty((0, 4))
+        rng = np.random.default_rng(seed)
+        coords = np.asarray(self.points, dtype=np.float64)
+        low, high = coords.min(axis=0), coords.max(axis=0)
+        centers = coords[rng.integers(0, len(coords), count)]
+        half = (high - low) * np.sqrt(10.0 ** rng.uniform(-6, 0, count))[:, None] / 2
+        return np.hstack([centers - half, centers + half])
+
+    def prune(self, rects: np.ndarray) -> Tuple[str, ...]:
+        # Zwalnia silniki, których plan nie wybiera dla żadnego z podanych
+        # prostokątów (zwykle po calibrate() na próbce typowego obciążenia);
+        # zwolniony silnik ma odtąd koszt nieskończony. Zwraca pozostawione.
+        rects = as_rectangles(rects)
+        if len(rects) == 0:
+            return self.engines
+        choice, _ = self.plan(rects)
+        self.engines = tuple(engine for e, engine in enumerate(ENGINES) if np.any(choice == e))
+        if "kdtree" not in self.engines:
+            self.kdtree = None
+        if "quadtree" not in self.engines:
+            self.quadtree = None
+        if "scan" not in self.engines:
+            self._live_coords = self._live_rows = self._live_counts = None
+        return self.engines
+
+    def _spread(self, low: np.ndarray, high: np.ndarray, axis: int) -> np.ndarray:
+        # Ułamek przedziału [low, high) przypadający na każdą kolumnę siatki;
+        # przedział zdegenerowany trafia w całości do kolumny swojego punktu.
+        a, b = self._grid_index(low, axis), self._grid_index(high, axis)
+        columns = np.arange(self.grid_size)
+        overlap = np.clip(np.minimum(b[:, None], columns + 1) - np.maximum(a[:, None], columns), 0, None)
+        width = b - a
+        point = (columns == np.minimum(np.floor(a), self.grid_size - 1)[:, None]).astype(np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(width[:, None] > 0, overlap / width[:, None], point)
+
+    def _grid_index(self, values: np.ndarray, axis: int) -> np.ndarray:
+        # Położenie w jednostkach siatki, obcięte do [0, grid_size]; przy
+        # zerowej rozpiętości osi wszystko przed punktem to 0, reszta to całość.
+        if self.step[axis] > 0:
+            return np.clip((values - self.origin[axis]) / self.step[axis], 0, self.grid_size)
+        return np.where(values >= self.origin[axis], float(self.grid_size), 0.0)
+
+    def _cumulative(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        # Szacowana liczba punktów w ćwiartce (-inf, x] x (-inf, y]:
+        # interpolacja dwuliniowa tablicy sum prefiksowych.
+        gx, gy = self._grid_index(x, 0), self._grid_index(y, 1)
+        ix = np.minimum(np.floor(gx).astype(np.intp), self.grid_size - 1)
+        iy = np.minimum(np.floor(gy).astype(np.intp), self.grid_size - 1)
+        fx, fy = gx - ix, gy - iy
+        p = self.prefix
+        return (
+            p[ix, iy] * (1 - fx) * (1 - fy) + p[ix + 1, iy] * fx * (1 - fy)
+            + p[ix, iy + 1] * (1 - fx) * fy + p[ix + 1, iy + 1] * fx * fy
+        )
+
+    def _window(self, rects: np.ndarray) -> np.ndarray:
+        # Cztery narożniki wszystkich prostokątów w jednym wywołaniu.
+        x = np.concatenate([rects[:, 2], rects[:, 0], rects[:, 2], rects[:, 0]])
+        y = np.concatenate([rects[:, 3], rects[:, 3], rects[:, 1], rects[:, 1]])
+        corners = self._cumulative(x, y).reshape(4, -1)
+        total = corners[0] - corners[1] - corners[2] + corners[3]
+        empty = (rects[:, 0] > rects[:, 2]) | (rects[:, 1] > rects[:, 3])
+        return np.where(empty, 0.0, np.maximum(total, 0.0))
+
+    def estimate(self, rects: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Szacowana liczba trafień oraz liczba punktów w pasie szerokości
+        # jednej kolumny siatki wzdłuż brzegu prostokąta - tam drzewa muszą
+        # testować pojedyncze punkty zamiast brać całe poddrzewa.
+        rects = as_rectangles(rects)
+        if self.prefix[-1, -1] == 0:
+            return np.zeros(len(rects)), np.zeros(len(rects))
+        margin = np.tile(self.step, 2) * np.array([-1, -1, 1, 1])
+        hits, outer, inner = self._window(np.concatenate([rects, rects + margin, rects - margin])).reshape(3, -1)
+        return hits, np.maximum(outer - inner, 0.0)
+
+    def _features(self, rects: np.ndarray) -> np.ndarray:
+        hits, boundary = self.estimate(rects)
+        return np.column_stack([
+            np.ones(len(rects)), np.full(len(rects), float(len(self.points))), hits, boundary,
+        ])
+
+    def plan(self, rects: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Numer silnika (indeks w ENGINES) i macierz kosztów (m, len(ENGINES));
+        # zwolnione silniki mają koszt nieskończony.
+        weights = np.array([[self.costs[engine][f] for f in FEATURES] for engine in ENGINES])
+        costs = self._features(rects) @ weights.T
+        costs[:, [engine not in self.engines for engine in ENGINES]] = np.inf
+        return np.argmin(costs, axis=1), costs
+
+    def explain(self, rectangle: Rectangle) -> dict:
+        rects = from_rectangle(rectangle)
+        hits, boundary = self.estimate(rects)
+        choice, costs = self.plan(rects)
+        return {
+            "engine": ENGINES[choice[0]],
+            "estimated_hits": float(hits[0]),
+            "boundary_points": float(boundary[0]),
+            "costs": dict(zip(ENGINES, costs[0].tolist())),
+        }
+
+    def _scan(self, rects: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Partiami, tak aby maska (prostokąty x punkty) miała najwyżej kilka
+        # milionów elementów.
+        coords = self._live_coords
+        queries, hits = [], []
+        step = max(1, 4_000_000 // max(len(coords), 1))
+        for start in range(0, len(rects), step):
+            r = rects[start:start + step, None, :]
+            mask = (
+                (r[..., 0] <= coords[:, 0]) & (coords[:, 0] <= r[..., 2])
+                & (r[..., 1] <= coords[:, 1]) & (coords[:, 1] <= r[..., 3])
+            )
+            q, pos = np.nonzero(mask)
+            queries.append(q + start)
+            hits.append(pos)
+        if not queries:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+        return np.concatenate(queries), np.concatenate(hits)
+
+    def _engine_query(self, engine: str, rects: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if engine == "kdtree":
+            return self.kdtree.query_many(rects)
+        if engine == "quadtree":
+            return self.quadtree.query_many(rects)
+        queries, hits = self._scan(rects)
+        offsets = np.zeros(len(rects) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(queries, minlength=len(rects)), out=offsets[1:])
+        return offsets, self._live_rows[hits], self._live_counts[hits]
+
+    def _engine_count(self, engine: str, rects: np.ndarray) -> np.ndarray:
+        if engine == "kdtree":
+            return self.kdtree.count_many(rects)
+        if engine == "quadtree":
+            return self.quadtree.count_many(rects)
+        queries, hits = self._scan(rects)
+        return np.bincount(queries, self._live_counts[hits], minlength=len(rects)).astype(np.int64)
+
+    def query_many(self, rects: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        rects = as_rectangles(rects)
+        choice, _ = self.plan(rects)
+        results: List[Tuple[np.ndarray, Tuple[np.ndarray, np.ndarray, np.ndarray]]] = []
+        lengths = np.zeros(len(rects), dtype=np.int64)
+        for e, engine in enumerate(ENGINES):
+            idx = np.flatnonzero(choice == e)
+            if len(idx) > 0:
+                result = self._engine_query(engine, rects[idx])
+                lengths[idx] = np.diff(result[0])
+                results.append((idx, result))
+
+        # Wyniki silników wracają do kolejności wejścia: trafienia j-tego
+        # prostokąta podzbioru trafiają pod offsets[idx[j]].
+        offsets = np.zeros(len(rects) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        rows = np.empty(offsets[-1], dtype=np.intp)
+        counts = np.empty(offsets[-1], dtype=np.int64)
+        for idx, (sub_offsets, sub_rows, sub_counts) in results:
+            local = np.repeat(np.arange(len(idx)), np.diff(sub_offsets))
+            dest = offsets[idx[local]] + np.arange(len(local)) - sub_offsets[local]
+            rows[dest] = sub_rows
+            counts[dest] = sub_counts
+        return offsets, rows, counts
+
+    def count_many(self, rects: np.ndarray) -> np.ndarray:
+        rects = as_rectangles(rects)
+        choice, _ = self.plan(rects)
+        totals = np.zeros(len(rects), dtype=np.int64)
+        for e, engine in enumerate(ENGINES):
+            idx = np.flatnonzero(choice == e)
+            if len(idx) > 0:
+                totals[idx] = self._engine_count(engine, rects[idx])
+        return totals
+
+    def search_rectangle(self, rectangle: Rectangle) -> Generator[Tuple[Tuple[float, float], int], None, None]:
+        _, rows, counts = self.query_many(from_rectangle(rectangle))
+        for (x, y), count in zip(self.points[rows].tolist(), counts.tolist()):
+            yield ((x, y), count)
+
+    def count_rectangle(self, rectangle: Rectangle) -> int:
+        return int(self.count_many(from_rectangle(rectangle))[0])
+
+    def memory_report(self) -> Dict[str, int]:
+        # Tablica punktów jest wspólna z drzewami - liczona raz.
+        report = {}
+        for prefix, tree in (("kdtree", self.kdtree), ("quadtree", self.quadtree)):
+            if tree is not None:
+                report.update({f"{prefix}_{name}": size for name, size in tree.memory_report().items() if name != "points"})
+        report.update({name: int(values.nbytes) for name, values in vars(self).items() if isinstance(values, np.ndarray)})
+        return report
+
+    def nbytes(self) -> int:
+        return sum(self.memory_report().values())
+
+    def calibrate(self, rects: np.ndarray, batch_size: int = 32, repeats: int = 3) -> Dict[str, Dict[str, float]]:
+        # Dopasowuje współczynniki kosztu metodą najmniejszych kwadratów
+        # (ujemne są zerowane). Prostokąty są mierzone partiami o podobnej
+        # szacowanej liczbie trafień, jak w query_many, a celem jest średni
+        # czas na prostokąt. Próbka powinna obejmować różne selektywności.
+        rects = as_rectangles(rects)
+        features = self._features(rects)
+        order = np.argsort(features[:, 2], kind="stable")
+        batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+        mean_features = np.array([features[batch].mean(axis=0) for batch in batches])
+        for engine in self.engines:
+            times = np.empty(len(batches))
+            for i, batch in enumerate(batches):
+                best = np.inf
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    self._engine_query(engine, rects[batch])
+                    best = min(best, time.perf_counter() - start)
+                times[i] = best / len(batch)
+            used = [j for j, f in enumerate(FEATURES) if DEFAULT_COSTS[engine][f] > 0]
+            fit, *_ = np.linalg.lstsq(mean_features[:, used], times, rcond=None)
+            self.costs[engine] = {f: 0.0 for f in FEATURES}
+            for j, value in zip(used, fit.tolist()):
+                self.costs[engine][FEATURES[j]] = max(value, 0.0)
+        return self.costs
@@ -0,0 +1,179 @@
+import numpy as np
+from typing import Tuple
+from .traversal import expand_ranges, kd_points
+
+
+class Polygon:
+    def __init__(self, vertices: np.ndarray):
+        vertices = np.asarray(vertices, dtype=np.float64)
+        if vertices.ndim != 2 or vertices.shape[1] != 2:
+            raise ValueError("Vertices array must be of shape (n_vertices, 2).")
+        if len(vertices) < 3:
+            raise ValueError("Polygon must have at least 3 vertices.")
+
+        self.vertices = vertices
+        self.edges = np.hstack([vertices, np.roll(vertices, -1, axis=0)])
+        self.bbox = np.concatenate([vertices.min(axis=0), vertices.max(axis=0)])
+
+        # Pasy (slaby) między kolejnymi różnymi wysokościami wierzchołków: żaden
+        # wierzchołek nie leży wewnątrz pasa, więc każda krawędź przecina pas
+        # w całości albo wcale. Krawędzie wielokąta prostego się nie przecinają,
+        # zatem w obrębie pasa mają stały porządek od lewej do prawej - liczbę
+        # przecięć półprostej daje wyszukiwanie binarne w posortowanym pasie.
+        self.levels = np.unique(vertices[:, 1])
+        ylo = np.minimum(self.edges[:, 1], self.edges[:, 3])
+        yhi = np.maximum(self.edges[:, 1], self.edges[:, 3])
+        first = np.searchsorted(self.levels, ylo)
+        last = np.searchsorted(self.levels, yhi)
+        edge_ids, band = expand_ranges(np.arange(len(self.edges)), first, last)
+        middle = (self.levels[band] + self.levels[band + 1]) / 2
+        order = np.lexsort((self._x_at(edge_ids, middle), band))
+        self.band_edges = edge_ids[order]
+        self.band_offsets = np.zeros(len(self.levels), dtype=np.intp)
+        np.cumsum(np.bincount(band, minlength=len(self.levels) - 1), out=self.band_offsets[1:])
+
+    def _x_at(self, edges: np.ndarray, y: np.ndarray) -> np.ndarray:
+        e = self.edges[edges]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return e[:, 0] + (y - e[:, 1]) * (e[:, 2] - e[:, 0]) / (e[:, 3] - e[:, 1])
+
+    def contains(self, points: np.ndarray) -> np.ndarray:
+        # Reguła parzystości dla półprostej w prawo; krawędź liczy się, gdy
+        # ylo <= y < yhi, czyli dokładnie wtedy, gdy przecina pas punktu.
+        band = np.searchsorted(self.levels, points[:, 1], side="right") - 1
+        valid = (band >= 0) & (band < len(self.levels) - 1)
+        band = np.where(valid, band, 0)
+        lo = np.where(valid, self.band_offsets[band], 0)
+        end = np.where(valid, self.band_offsets[np.minimum(band + 1, len(self.band_offsets) - 1)], 0)
+        hi = end.copy()
+        active = np.flatnonzero(lo < hi)
+        while len(active) > 0:
+            mid = (lo[active] + hi[active]) // 2
+            left = self._x_at(self.band_edges[mid], points[active, 1]) <= points[active, 0]
+            lo[active[left]] = mid[left] + 1
+            hi[active[~left]] = mid[~left]
+            active = active[lo[active] < hi[active]]
+        return (end - lo) % 2 == 1
+
+    def touching(self, boxes: np.ndarray, edges: np.ndarray) -> np.ndarray:
+        # Czy odcinek edges[i] ma punkt wspólny z domkniętym prostokątem
+        # boxes[i]: prostokąty obwiedni muszą się przecinać, a narożniki
+        # prostokąta nie mogą leżeć ściśle po jednej stronie prostej krawędzi.
+        e = self.edges[edges]
+        overlap = (
+            (np.minimum(e[:, 0], e[:, 2]) <= boxes[:, 2]) & (np.maximum(e[:, 0], e[:, 2]) >= boxes[:, 0])
+            & (np.minimum(e[:, 1], e[:, 3]) <= boxes[:, 3]) & (np.maximum(e[:, 1], e[:, 3]) >= boxes[:, 1])
+        )
+        dx, dy = e[:, 2] - e[:, 0], e[:, 3] - e[:, 1]
+        sides = np.stack([
+            dx * (boxes[:, y] - e[:, 1]) - dy * (boxes[:, x] - e[:, 0])
+            for x, y in ((0, 1), (2, 1), (0, 3), (2, 3))
+        ])
+        return overlap & ~np.all(sides > 0, axis=0) & ~np.all(sides < 0, axis=0)
+
+
+# Obszary węzłów są klasyfikowane względem wielokąta przy pomocy par
+# (węzeł, krawędź): dziecko dziedziczy tylko krawędzie, które dotykały obszaru
+# rodzica. Obszar bez żadnej krawędzi leży w całości po jednej stronie brzegu,
+# więc wystarczy test jednego narożnika - wnętrze trafia do wyniku jako
+# przedział [lo, hi) bez testów punktów, zewnętrze jest odrzucane. Punkty są
+# testowane tylko w węzłach przecinanych przez brzeg.
+
+def _split_pairs(
+    pair_node: np.ndarray, pair_edge: np.ndarray, masks: Tuple[np.ndarray, ...]
+) -> Tuple[np.ndarray, np.ndarray]:
+    nodes, edges, offset = [], [], 0
+    for mask in masks:
+        index = np.cumsum(mask) - 1 + offset
+        keep = mask[pair_node]
+        nodes.append(index[pair_node[keep]])
+        edges.append(pair_edge[keep])
+        offset += np.count_nonzero(mask)
+    return np.concatenate(nodes), np.concatenate(edges)
+
+
+def kd_polygon(
+    coords: np.ndarray,
+    axes: np.ndarray,
+    left: np.ndarray,
+    right: np.ndarray,
+    ends: np.ndarray,
+    bbox: np.ndarray,
+    polygon: Polygon,
+) -> Tuple[Tuple[np.ndarray, np.ndarray], np.ndarray]:
+    covered, hits = ([], []), []
+    node = np.zeros(1 if len(coords) > 0 else 0, dtype=np.intp)
+    cell = np.tile(bbox, (len(node), 1))
+    pair_node = np.zeros(len(polygon.edges) * len(node), dtype=np.intp)
+    pair_edge = np.arange(len(pair_node))
+    while len(node) > 0:
+        touch = polygon.touching(cell[pair_node], pair_edge)
+        pair_node, pair_edge = pair_node[touch], pair_edge[touch]
+        crossing = np.zeros(len(node), dtype=bool)
+        crossing[pair_node] = True
+
+        free = node[~crossing]
+        inside = free[polygon.contains(cell[~crossing, :2])]
+        covered[0].append(inside)
+        covered[1].append(ends[inside])
+
+        pair_node = (np.cumsum(crossing) - 1)[pair_node]
+        node, cell = node[crossing], cell[crossing]
+        _, pos = kd_points(node, node, left, right, ends)
+        hits.append(pos[polygon.contains(coords[pos])])
+
+        axis = axes[node]
+        split = coords[node, axis]
+        l, r = left[node], right[node]
+        go_left, go_right = l >= 0, r >= 0
+        pair_node, pair_edge = _split_pairs(pair_node, pair_edge, (go_left, go_right))
+        left_cell, right_cell = cell[go_left], cell[go_right]
+        left_cell[np.arange(len(left_cell)), axis[go_left] + 2] = split[go_left]
+        right_cell[np.arange(len(right_cell)), axis[go_right]] = split[go_right]
+        node = np.concatenate([l[go_left], r[go_right]])
+        cell = np.concatenate([left_cell, right_cell])
+
+    return (
+        tuple(np.concatenate(part) if part else np.empty(0, dtype=np.intp) for part in covered),
+        np.concatenate(hits) if hits else np.empty(0, dtype=np.intp),
+    )
+
+
+def quad_polygon(
+    bounds: np.ndarray,
+    children: np.ndarray,
+    lo: np.ndarray,
+    hi: np.ndarray,
+    coords: np.ndarray,
+    polygon: Polygon,
+) -> Tuple[Tuple[np.ndarray, np.ndarray], np.ndarray]:
+    covered, hits = ([], []), []
+    node = np.zeros(1 if len(bounds) > 0 else 0, dtype=np.intp)
+    pair_node = np.zeros(len(polygon.edges) * len(node), dtype=np.intp)
+    pair_edge = np.arange(len(pair_node))
+    while len(node) > 0:
+        b = bounds[node]
+        touch = polygon.touching(b[pair_node], pair_edge)
+        pair_node, pair_edge = pair_node[touch], pair_edge[touch]
+        crossing = np.zeros(len(node), dtype=bool)
+        crossing[pair_node] = True
+
+        inside = node[~crossing][polygon.contains(b[~crossing, :2])]
+        covered[0].append(lo[inside])
+        covered[1].append(hi[inside])
+
+        pair_node = (np.cumsum(crossing) - 1)[pair_node]
+        node = node[crossing]
+        leaf = children[node, 0] < 0
+        _, pos = expand_ranges(node[leaf], lo[node[leaf]], hi[node[leaf]])
+        hits.append(pos[polygon.contains(coords[pos])])
+
+        node_children = children[node]
+        masks = tuple((node_children[:, j] >= 0) & ~leaf for j in range(children.shape[1]))
+        pair_node, pair_edge = _split_pairs(pair_node, pair_edge, masks)
+        node = np.concatenate([node_children[mask, j] for j, mask in enumerate(masks)])
+
+    return (
+        tuple(np.concatenate(part) if part else np.empty(0, dtype=np.intp) for part in covered),
+        np.concatenate(hits) if hits else np.empty(0, dtype=np.intp),
+    )
@@ -0,0 +1,83 @@
+import numpy as np
+
+
+class Quantizer:
+    # Współrzędne drzewa w zmniejszonej precyzji. Typ zmiennoprzecinkowy
+    # (np. float32) to zwykłe rzutowanie, typ całkowity (np. int32, int16) to
+    # stały przecinek względem obwiedni: q = rint((x - low) / scale) + base,
+    # z jedną skalą dla obu osi, więc okręgi pozostają okręgami.
+    #
+    # Kodowanie jest monotoniczne na każdej osi, więc prostokąt o zakodowanych
+    # rogach zawiera zakodowane wszystkie punkty oryginalnego prostokąta -
+    # drzewo zwraca nadzbiór, sprawdzany potem na oryginalnych współrzędnych.
+    # error to największe przesunięcie punktu na osi przez kodowanie (w
+    # jednostkach q) - o tyle poszerzane są okręgi i promienie kNN.
+    def __init__(self, dtype: np.dtype, points: np.ndarray):
+        self.dtype = np.dtype(dtype)
+        if self.dtype.kind not in "fiu":
+            raise ValueError("dtype must be a floating point or integer type.")
+        # Granice typów całkowitych szerszych niż 32 bity nie są dokładnie
+        # reprezentowalne we float64, więc rzutowanie po clip się przepełnia.
+        if self.dtype.kind in "iu" and self.dtype.itemsize > 4:
+            raise ValueError("Integer dtype must be at most 32 bits wide.")
+        self.low, self.scale, self.base = np.zeros(2), 1.0, 0.0
+        if self.dtype.kind in "iu" and len(points) > 0:
+            info = np.iinfo(self.dtype)
+            self.low = points.min(axis=0).astype(np.float64)
+            extent = float((points.max(axis=0) - self.low).max())
+            self.scale = extent / (float(info.max) - float(info.min)) if extent > 0 else 1.0
+            self.base = float(info.min)
+        self.error = 0.0
+
+    def affine(self, points: np.ndarray) -> np.ndarray:
+        return (np.asarray(points, dtype=np.float64) - self.low) / self.scale + self.base
+
+    def encode(self, points: np.ndarray) -> np.ndarray:
+        q = self.affine(points)
+        if self.dtype.kind in "iu":
+            info = np.iinfo(self.dtype)
+            q = np.clip(np.rint(q), info.min, info.max)
+        # Przepełnienie typu zmiennoprzecinkowego daje ±inf: dla rogów
+        # prostokątów to poprawne granice, punkty sprawdza store().
+        with np.errstate(over="ignore"):
+            return q.astype(self.dtype)
+
+    def decode(self, coords: np.ndarray) -> np.ndarray:
+        return (coords.astype(np.float64) - self.base) * self.scale + self.low
+
+    def store(self, points: np.ndarray) -> np.ndarray:
+        # Kodowanie punktów trafiających do drzewa; poszerza error.
+        coords = self.encode(points)
+        if not np.all(np.isfinite(coords)):
+            raise ValueError("Points are out of range for dtype.")
+        if len(points) > 0:
+            shift = np.abs(coords.astype(np.float64) - self.affine(points)).max()
+            self.error = max(self.error, float(shift))
+        return coords
+
+    def rectangles(self, rects: np.ndarray) -> np.ndarray:
+        return np.hstack([self.encode(rects[:, :2]), self.encode(rects[:, 2:])])
+
+    def widen(self, center: np.ndarray, radius: np.ndarray) -> np.ndarray:
+        # Okręgi w jednostkach q powiększone o przesunięcie punktu (error na
+        # każdej osi) i zapas na zaokrąglenia float64 w testach odległości.
+        radius = radius + self.error * np.sqrt(2)
+        radius = radius + 1e-9 * (radius + np.abs(center).max(axis=1) + 1)
+        return np.column_stack([center, radius])
+
+    def circles(self, circles: np.ndarray) -> np.ndarray:
+        return self.widen(self.affine(circles[:, :2]), circles[:, 2] / self.scale)
+
+    def state(self) -> dict:
+        return {
+            "dtype": self.dtype.str, "low": self.low.tolist(), "scale": self.scale,
+            "base": self.base, "error": self.error,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "Quantizer":
+        quantizer = cls.__new__(cls)
+        quantizer.dtype = np.dtype(state["dtype"])
+        quantizer.low = np.array(state["low"], dtype=np.float64)
+        quantizer.scale, quantizer.base, quantizer.error = state["scale"], state["base"], state["error"]
+        return quantizer
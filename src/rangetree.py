@@ -0,0 +1,141 @@
+import numpy as np
+from typing import Dict, Generator, Tuple
+from .rectangle import Rectangle
+from .batch import as_rectangles, csr_order, from_rectangle
+from .duplicates import group_duplicates, regroup_rows
+from .traversal import expand_ranges
+
+
+class RangeTree:
+    def __init__(self, points: np.ndarray):
+        if not isinstance(points, np.ndarray):
+            raise TypeError("Points must be a NumPy ndarray.")
+        if points.ndim != 2 or points.shape[1] != 2:
+            raise ValueError("Points array must be of shape (n_points, 2).")
+
+        self.points = points
+        unique_points, counts, first_rows, row_order = group_duplicates(points)
+        order = np.lexsort((unique_points[:, 1], unique_points[:, 0]))
+        self.coords = unique_points[order]
+        self.counts = counts[order].astype(np.int64)
+        self.cum_counts = np.concatenate([[0], np.cumsum(self.counts)])
+        self.rows = first_rows[order]
+        self.row_order = regroup_rows(row_order, self.rows, self.counts)
+
+        # Drzewo główne to drzewo przedziałów nad pozycjami punktów w
+        # kolejności x (pozycje uzupełnione do 2^height). Poziom l ma węzły
+        # -bloki [j * B, (j + 1) * B) dla B = 2^(height - l) - a struktura
+        # pomocnicza węzła to punkty bloku posortowane po y. Wszystkie bloki
+        # poziomu leżą jeden za drugim, więc poziom to jeden wiersz tablic:
+        #   ids[l]        - pozycje punktów (kolejność x) w porządku bloków,
+        #   weights[l]    - sumy prefiksowe krotności w tym porządku,
+        #   left_ranks[l] - sumy prefiksowe "punkt trafia do lewego dziecka".
+        # left_ranks to kaskadowanie ułamkowe: przedział y znaleziony w
+        # węźle przechodzi do dzieci w O(1), bez ponownego wyszukiwania, więc
+        # wyszukiwanie binarne po y jest jedno - w korzeniu (self.ys).
+        n = len(self.coords)
+        index_dtype = np.int32 if n < np.iinfo(np.int32).max else np.int64
+        self.height = int(np.ceil(np.log2(n))) if n > 1 else 0
+        # Ranga y (remisy według pozycji) porządkuje punkty ściśle, więc blok
+        # rodzica jest scaleniem bloków dzieci w tej samej kolejności.
+        y_order = np.lexsort((np.arange(n), self.coords[:, 1]))
+        y_rank = np.empty(n, dtype=np.int64)
+        y_rank[y_order] = np.arange(n)
+        positions = np.arange(n, dtype=np.int64)
+
+        self.ids = np.empty((self.height + 1, n), dtype=index_dtype)
+        self.weights = np.zeros((self.height + 1, n + 1), dtype=np.int64)
+        self.left_ranks = np.zeros((self.height, n + 1), dtype=index_dtype)
+        for level in range(self.height + 1):
+            size = 1 << (self.height - level)
+            ids = np.argsort((positions // size) * n + y_rank, kind="stable")
+            self.ids[level] = ids
+            np.cumsum(self.counts[ids], out=self.weights[level, 1:])
+            if level < self.height:
+                np.cumsum((ids % size) < size // 2, out=self.left_ranks[level, 1:])
+        self.ys = self.coords[self.ids[0], 1]
+
+    def _canonical(self, rects: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        # Rozkład prostokątów na węzły kanoniczne: (zapytanie, poziom, [lo, hi)
+        # w wierszu poziomu) - punkty tych przedziałów to dokładnie trafienia.
+        # Na każdym poziomie zapytanie ma co najwyżej dwa węzły częściowe.
+        n = len(self.coords)
+        a = np.searchsorted(self.coords[:, 0], rects[:, 0], side="left")
+        b = np.searchsorted(self.coords[:, 0], rects[:, 2], side="right")
+        query = np.flatnonzero(a < b)
+        lo = np.searchsorted(self.ys, rects[query, 1], side="left")
+        hi = np.searchsorted(self.ys, rects[query, 3], side="right")
+        start = np.zeros(len(query), dtype=np.int64)
+
+        out = ([], [], [], [])
+        covered = (a[query] == 0) & (b[query] == n)
+        for target, values in zip(out, (query[covered], np.zeros(np.count_nonzero(covered), dtype=np.intp),
+                                        lo[covered], hi[covered])):
+            target.append(values)
+        keep = ~covered & (hi > lo)
+        query, lo, hi, start = query[keep], lo[keep], hi[keep], start[keep]
+
+        for level in range(self.height):
+            size = 1 << (self.height - level)
+            ranks = self.left_ranks[level]
+            base = ranks[start]
+            left_lo, left_hi = start + ranks[lo] - base, start + ranks[hi] - base
+            middle = start + size // 2
+            right_lo, right_hi = middle + (lo - start) - (left_lo - start), middle + (hi - start) - (left_hi - start)
+
+            query = np.concatenate([query, query])
+            start = np.concatenate([start, middle])
+            end = np.minimum(start + size // 2, n)
+            lo, hi = np.concatenate([left_lo, right_lo]), np.concatenate([left_hi, right_hi])
+            first, last = a[query], b[query]
+            alive = (hi > lo) & (start < last) & (end > first)
+            inside = alive & (first <= start) & (end <= last)
+            for target, values in zip(out, (query[inside], np.full(np.count_nonzero(inside), level + 1),
+                                            lo[inside], hi[inside])):
+                target.append(values)
+            partial = alive & ~inside
+            query, start, lo, hi = query[partial], start[partial], lo[partial], hi[partial]
+
+        return tuple(np.concatenate(values) for values in out)
+
+    def _range(self, rects: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        query, level, lo, hi = self._canonical(rects)
+        n = len(self.coords)
+        query, flat = expand_ranges(query, level * n + lo, level * n + hi)
+        return query, self.ids.ravel()[flat].astype(np.intp)
+
+    def _search(self, rectangle: Rectangle) -> np.ndarray:
+        return np.sort(self._range(from_rectangle(rectangle))[1])
+
+    def search_rectangle(self, rectangle: Rectangle) -> Generator[Tuple[float, float], None, None]:
+        for x, y in self.coords[self._search(rectangle)].tolist():
+            yield (x, y)
+
+    def search_rectangle_with_count(self, rectangle: Rectangle) -> Generator[Tuple[Tuple[float, float], int], None, None]:
+        hits = self._search(rectangle)
+        for (x, y), count in zip(self.coords[hits].tolist(), self.counts[hits].tolist()):
+            yield ((x, y), count)
+
+    def query_many(self, rects: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        rects = as_rectangles(rects)
+        queries, hits = self._range(rects)
+        offsets, order = csr_order(len(rects), queries)
+        hits = hits[order]
+        return offsets, self.rows[hits], self.counts[hits]
+
+    def count_rectangle(self, rectangle: Rectangle) -> int:
+        return int(self.count_many(from_rectangle(rectangle))[0])
+
+    def count_many(self, rects: np.ndarray) -> np.ndarray:
+        # Liczba punktów z krotnościami to suma różnic sum prefiksowych węzłów
+        # kanonicznych - O(log n) na zapytanie niezależnie od liczby trafień.
+        rects = as_rectangles(rects)
+        query, level, lo, hi = self._canonical(rects)
+        totals = np.bincount(query, self.weights[level, hi] - self.weights[level, lo], minlength=len(rects))
+        return totals.astype(np.int64)
+
+    def memory_report(self) -> Dict[str, int]:
+        return {name: int(values.nbytes) for name, values in vars(self).items() if isinstance(values, np.ndarray)}
+
+    def nbytes(self) -> int:
+        return sum(self.memory_report().values())
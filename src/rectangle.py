@@ -1,6 +1,8 @@
 from typing import Tuple
 
 class Rectangle:
+    __slots__ = ["extreme"]
+
     def __init__(self, xmin: float, ymin: float, xmax: float, ymax: float):
         self.extreme = [[xmin, xmax], [ymin, ymax]]
         for p1, p2 in self.extreme:
@@ -0,0 +1,428 @@
+import numpy as np
+from typing import Tuple
+
+
+class HitBuffer:
+    def __init__(self, capacity: int):
+        self.queries = np.empty(max(capacity, 1), dtype=np.intp)
+        self.hits = np.empty(max(capacity, 1), dtype=np.intp)
+        self.size = 0
+
+    def extend(self, queries: np.ndarray, hits: np.ndarray) -> None:
+        end = self.size + len(hits)
+        if end > len(self.hits):
+            capacity = max(end, 2 * len(self.hits))
+            self.queries = np.resize(self.queries, capacity)
+            self.hits = np.resize(self.hits, capacity)
+        self.queries[self.size:end] = queries
+        self.hits[self.size:end] = hits
+        self.size = end
+
+    def result(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self.queries[:self.size].copy(), self.hits[:self.size].copy()
+
+
+# Oba silniki przechodzą drzewo bez rekurencji i generatorów: stos zawiera
+# cały poziom drzewa naraz jako pary (węzeł, zapytanie), a trafienia trafiają
+# do wcześniej zaalokowanego bufora. Zwracane są numery zapytań i pozycje
+# punktów w tablicy coords drzewa.
+
+def kd_points(
+    query: np.ndarray, node: np.ndarray, left: np.ndarray, right: np.ndarray, ends: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Punkty testowane w odwiedzanych węzłach kd-drzewa: węzeł wewnętrzny to
+    # jeden punkt, a liść (węzeł bez dzieci) to cały kubełek [node, ends[node]),
+    # sprawdzany jednym porównaniem tablicowym.
+    leaf = (left[node] < 0) & (right[node] < 0)
+    return expand_ranges(query, node, np.where(leaf, ends[node], node + 1))
+
+
+def kd_range(
+    coords: np.ndarray,
+    axes: np.ndarray,
+    left: np.ndarray,
+    right: np.ndarray,
+    ends: np.ndarray,
+    rects: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    out = HitBuffer(len(coords))
+    node = np.zeros(len(rects) if len(coords) > 0 else 0, dtype=np.intp)
+    query = np.arange(len(node))
+    while len(node) > 0:
+        r = rects[query]
+        q, pos = kd_points(query, node, left, right, ends)
+        p, rq = coords[pos], rects[q]
+        inside = (
+            (rq[:, 0] <= p[:, 0]) & (p[:, 0] <= rq[:, 2])
+            & (rq[:, 1] <= p[:, 1]) & (p[:, 1] <= rq[:, 3])
+        )
+        out.extend(q[inside], pos[inside])
+
+        axis = axes[node]
+        rows = np.arange(len(node))
+        split = coords[node, axis]
+        l, r_ = left[node], right[node]
+        go_left = (l >= 0) & (r[rows, axis] <= split)
+        go_right = (r_ >= 0) & (r[rows, axis + 2] >= split)
+        node = np.concatenate([l[go_left], r_[go_right]])
+        query = np.concatenate([query[go_left], query[go_right]])
+
+    return out.result()
+
+
+def expand_ranges(
+    query: np.ndarray, lo: np.ndarray, hi: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    sizes = hi - lo
+    positions = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes - lo, sizes)
+    return np.repeat(query, sizes), positions
+
+
+def quad_range(
+    bounds: np.ndarray,
+    children: np.ndarray,
+    lo: np.ndarray,
+    hi: np.ndarray,
+    coords: np.ndarray,
+    rects: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    out = HitBuffer(len(coords))
+    node = np.zeros(len(rects) if len(bounds) > 0 else 0, dtype=np.intp)
+    query = np.arange(len(node))
+    while len(node) > 0:
+        b, r = bounds[node], rects[query]
+        keep = (
+            (r[:, 2] >= b[:, 0]) & (r[:, 0] <= b[:, 2])
+            & (r[:, 3] >= b[:, 1]) & (r[:, 1] <= b[:, 3])
+        )
+        node, query, b, r = node[keep], query[keep], b[keep], r[keep]
+
+        # Poddrzewo, którego prostokąt leży w całości w zapytaniu, jest
+        # wypisywane w całości jako przedział [lo, hi), bez testu punktów.
+        covered = (
+            (r[:, 0] <= b[:, 0]) & (b[:, 2] <= r[:, 2])
+            & (r[:, 1] <= b[:, 1]) & (b[:, 3] <= r[:, 3])
+        )
+        out.extend(*expand_ranges(query[covered], lo[node[covered]], hi[node[covered]]))
+        node, query = node[~covered], query[~covered]
+
+        leaf = children[node, 0] < 0
+        q, pos = expand_ranges(query[leaf], lo[node[leaf]], hi[node[leaf]])
+        p, r = coords[pos], rects[q]
+        inside = (
+            (r[:, 0] <= p[:, 0]) & (p[:, 0] <= r[:, 2])
+            & (r[:, 1] <= p[:, 1]) & (p[:, 1] <= r[:, 3])
+        )
+        out.extend(q[inside], pos[inside])
+
+        node_children = children[node[~leaf]]
+        valid = node_children >= 0
+        node = node_children[valid]
+        query = np.repeat(query[~leaf], children.shape[1])[valid.ravel()]
+
+    return out.result()
+
+
+# Zapytania o koło (cx, cy, r): węzeł jest odrzucany, gdy najmniejsza
+# odległość środka od jego obszaru przekracza r, a przyjmowany w całości,
+# gdy nawet najdalszy róg obszaru leży w kole. Silniki zwracają osobno
+# przedziały pokrytych poddrzew oraz pojedyncze trafienia, więc ten sam wynik
+# służy do wyszukiwania i do zliczania.
+
+def disk_gaps(regions: np.ndarray, circles: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    center, r2 = circles[:, :2], circles[:, 2] ** 2
+    near = np.maximum(np.maximum(regions[:, :2] - center, center - regions[:, 2:]), 0)
+    far = np.maximum(np.abs(regions[:, :2] - center), np.abs(regions[:, 2:] - center))
+    return (near ** 2).sum(axis=1) <= r2, (far ** 2).sum(axis=1) <= r2
+
+
+def in_disks(p: np.ndarray, circles: np.ndarray) -> np.ndarray:
+    return ((p - circles[:, :2]) ** 2).sum(axis=1) <= circles[:, 2] ** 2
+
+
+def kd_disk(
+    coords: np.ndarray,
+    axes: np.ndarray,
+    left: np.ndarray,
+    right: np.ndarray,
+    ends: np.ndarray,
+    bbox: np.ndarray,
+    circles: np.ndarray,
+) -> Tuple[Tuple[np.ndarray, np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray]]:
+    covered, hits = ([], [], []), HitBuffer(len(coords))
+    node = np.zeros(len(circles) if len(coords) > 0 else 0, dtype=np.intp)
+    query = np.arange(len(node))
+    cell = np.tile(bbox, (len(node), 1))
+    while len(node) > 0:
+        c = circles[query]
+        keep, inner = disk_gaps(cell, c)
+        for part, values in zip(covered, (query, node, ends[node])):
+            part.append(values[inner])
+        keep &= ~inner
+        node, query, cell, c = node[keep], query[keep], cell[keep], c[keep]
+
+        q, pos = kd_points(query, node, left, right, ends)
+        inside = in_disks(coords[pos], circles[q])
+        hits.extend(q[inside], pos[inside])
+
+        axis = axes[node]
+        split = coords[node, axis]
+        l, r = left[node], right[node]
+        go_left, go_right = l >= 0, r >= 0
+        left_cell, right_cell = cell[go_left], cell[go_right]
+        left_cell[np.arange(len(left_cell)), axis[go_left] + 2] = split[go_left]
+        right_cell[np.arange(len(right_cell)), axis[go_right]] = split[go_right]
+        node = np.concatenate([l[go_left], r[go_right]])
+        query = np.concatenate([query[go_left], query[go_right]])
+        cell = np.concatenate([left_cell, right_cell])
+
+    covered = tuple(np.concatenate(part) if part else np.empty(0, dtype=np.intp) for part in covered)
+    return covered, hits.result()
+
+
+def quad_disk(
+    bounds: np.ndarray,
+    children: np.ndarray,
+    lo: np.ndarray,
+    hi: np.ndarray,
+    coords: np.ndarray,
+    circles: np.ndarray,
+) -> Tuple[Tuple[np.ndarray, np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray]]:
+    covered, hits = ([], [], []), HitBuffer(len(coords))
+    node = np.zeros(len(circles) if len(bounds) > 0 else 0, dtype=np.intp)
+    query = np.arange(len(node))
+    while len(node) > 0:
+        c = circles[query]
+        keep, inner = disk_gaps(bounds[node], c)
+        for part, values in zip(covered, (query, lo[node], hi[node])):
+            part.append(values[inner])
+        keep &= ~inner
+        node, query = node[keep], query[keep]
+
+        leaf = children[node, 0] < 0
+        q, pos = expand_ranges(query[leaf], lo[node[leaf]], hi[node[leaf]])
+        inside = in_disks(coords[pos], circles[q])
+        hits.extend(q[inside], pos[inside])
+
+        node_children = children[node[~leaf]]
+        valid = node_children >= 0
+        node = node_children[valid]
+        query = np.repeat(query[~leaf], children.shape[1])[valid.ravel()]
+
+    covered = tuple(np.concatenate(part) if part else np.empty(0, dtype=np.intp) for part in covered)
+    return covered, hits.result()
+
+
+# Zliczanie: węzeł, którego obszar w całości mieści się w zapytaniu, wnosi
+# zapisaną sumę krotności poddrzewa bez schodzenia niżej. Sumy poddrzew są
+# różnicami skumulowanych krotności, bo każde poddrzewo to ciągły przedział.
+
+def kd_count(
+    coords: np.ndarray,
+    axes: np.ndarray,
+    left: np.ndarray,
+    right: np.ndarray,
+    ends: np.ndarray,
+    cum_counts: np.ndarray,
+    bbox: np.ndarray,
+    rects: np.ndarray,
+) -> np.ndarray:
+    totals = np.zeros(len(rects), dtype=np.int64)
+    node = np.zeros(len(rects) if len(coords) > 0 else 0, dtype=np.intp)
+    query = np.arange(len(node))
+    # Obszar komórki węzła nie jest przechowywany - wyznacza go ścieżka od
+    # korzenia, więc liczymy go po drodze, zaczynając od prostokąta danych.
+    cell = np.tile(bbox, (len(node), 1))
+    while len(node) > 0:
+        r = rects[query]
+        covered = (
+            (r[:, 0] <= cell[:, 0]) & (cell[:, 2] <= r[:, 2])
+            & (r[:, 1] <= cell[:, 1]) & (cell[:, 3] <= r[:, 3])
+        )
+        done = node[covered]
+        totals += np.bincount(
+            query[covered], cum_counts[ends[done]] - cum_counts[done], minlength=len(rects)
+        ).astype(np.int64)
+        node, query, cell, r = node[~covered], query[~covered], cell[~covered], r[~covered]
+
+        q, pos = kd_points(query, node, left, right, ends)
+        p, rq = coords[pos], rects[q]
+        inside = (
+            (rq[:, 0] <= p[:, 0]) & (p[:, 0] <= rq[:, 2])
+            & (rq[:, 1] <= p[:, 1]) & (p[:, 1] <= rq[:, 3])
+        )
+        totals += np.bincount(
+            q[inside], cum_counts[pos[inside] + 1] - cum_counts[pos[inside]],
+            minlength=len(rects),
+        ).astype(np.int64)
+
+        axis = axes[node]
+        rows = np.arange(len(node))
+        split = coords[node, axis]
+        l, r_ = left[node], right[node]
+        go_left = (l >= 0) & (r[rows, axis] <= split)
+        go_right = (r_ >= 0) & (r[rows, axis + 2] >= split)
+        left_cell, right_cell = cell[go_left], cell[go_right]
+        left_cell[np.arange(len(left_cell)), axis[go_left] + 2] = split[go_left]
+        right_cell[np.arange(len(right_cell)), axis[go_right]] = split[go_right]
+        node = np.concatenate([l[go_left], r_[go_right]])
+        query = np.concatenate([query[go_left], query[go_right]])
+        cell = np.concatenate([left_cell, right_cell])
+
+    return totals
+
+
+def quad_count(
+    bounds: np.ndarray,
+    children: np.ndarray,
+    lo: np.ndarray,
+    hi: np.ndarray,
+    coords: np.ndarray,
+    cum_counts: np.ndarray,
+    rects: np.ndarray,
+) -> np.ndarray:
+    totals = np.zeros(len(rects), dtype=np.int64)
+    node = np.zeros(len(rects) if len(bounds) > 0 else 0, dtype=np.intp)
+    query = np.arange(len(node))
+    while len(node) > 0:
+        b, r = bounds[node], rects[query]
+        keep = (
+            (r[:, 2] >= b[:, 0]) & (r[:, 0] <= b[:, 2])
+            & (r[:, 3] >= b[:, 1]) & (r[:, 1] <= b[:, 3])
+        )
+        node, query, b, r = node[keep], query[keep], b[keep], r[keep]
+
+        covered = (
+            (r[:, 0] <= b[:, 0]) & (b[:, 2] <= r[:, 2])
+            & (r[:, 1] <= b[:, 1]) & (b[:, 3] <= r[:, 3])
+        )
+        done = node[covered]
+        totals += np.bincount(
+            query[covered], cum_counts[hi[done]] - cum_counts[lo[done]], minlength=len(rects)
+        ).astype(np.int64)
+        node, query = node[~covered], query[~covered]
+
+        leaf = children[node, 0] < 0
+        q, pos = expand_ranges(query[leaf], lo[node[leaf]], hi[node[leaf]])
+        p, r = coords[pos], rects[q]
+        inside = (
+            (r[:, 0] <= p[:, 0]) & (p[:, 0] <= r[:, 2])
+            & (r[:, 1] <= p[:, 1]) & (p[:, 1] <= r[:, 3])
+        )
+        totals += np.bincount(
+            q[inside], cum_counts[pos[inside] + 1] - cum_counts[pos[inside]],
+            minlength=len(rects),
+        ).astype(np.int64)
+
+        node_children = children[node[~leaf]]
+        valid = node_children >= 0
+        node = node_children[valid]
+        query = np.repeat(query[~leaf], children.shape[1])[valid.ravel()]
+
+    return totals
+
+
+class NearestBuffer:
+    # Ograniczony kopiec dla wielu zapytań naraz: dla każdego zapytania k
+    # najbliższych kandydatów (pozycja, odległość^2, krotność). Punkt o
+    # krotności c zajmuje c miejsc, więc kandydatów może być mniej niż k.
+    def __init__(self, n_queries: int, k: int):
+        self.k = k
+        self.dist = np.full((n_queries, k), np.inf)
+        self.pos = np.full((n_queries, k), -1, dtype=np.intp)
+        self.weight = np.zeros((n_queries, k), dtype=np.int64)
+
+    def push(self, queries: np.ndarray, dist: np.ndarray, pos: np.ndarray, weight: np.ndarray) -> None:
+        # Scalane są tylko wiersze zapytań, które dostały nowych kandydatów.
+        k = self.k
+        touched = np.unique(queries)
+        q = np.concatenate([np.repeat(touched, k), queries])
+        d = np.concatenate([self.dist[touched].ravel(), dist])
+        p = np.concatenate([self.pos[touched].ravel(), pos])
+        w = np.concatenate([self.weight[touched].ravel(), weight])
+        valid = w > 0
+        q, d, p, w = q[valid], d[valid], p[valid], w[valid]
+        order = np.lexsort((d, q))
+        q, d, p, w = q[order], d[order], p[order], w[order]
+
+        starts = np.searchsorted(q, q)
+        cum = np.cumsum(w)
+        keep = cum - w - (cum - w)[starts] < k
+        q, d, p, w = q[keep], d[keep], p[keep], w[keep]
+        rank = np.arange(len(q)) - np.searchsorted(q, q)
+
+        self.dist[touched] = np.inf
+        self.pos[touched] = -1
+        self.weight[touched] = 0
+        self.dist[q, rank], self.pos[q, rank], self.weight[q, rank] = d, p, w
+
+    def bound(self) -> np.ndarray:
+        # Odległość^2 k-tego sąsiada, a dopóki nie ma k kandydatów - nieskończoność.
+        full = self.weight.sum(axis=1) >= self.k
+        last = np.maximum(np.count_nonzero(self.weight, axis=1) - 1, 0)
+        return np.where(full, self.dist[np.arange(len(self.dist)), last], np.inf)
+
+
+def kd_nearest(
+    coords: np.ndarray,
+    axes: np.ndarray,
+    left: np.ndarray,
+    right: np.ndarray,
+    ends: np.ndarray,
+    cum_counts: np.ndarray,
+    bbox: np.ndarray,
+    points: np.ndarray,
+    best: NearestBuffer,
+    offset: int = 0,
+) -> None:
+    if len(coords) == 0:
+        return
+
+    # Najpierw każde zapytanie schodzi po bliższej stronie podziałów do
+    # poddrzewa o kilku k punktach i wrzuca je całe do kopca - to daje ciasne
+    # początkowe ograniczenie. Przedział poddrzewa jest ciągły w tablicach.
+    target = max(4 * best.k, 16)
+    start = np.zeros(len(points), dtype=np.intp)
+    query = np.arange(len(points))
+    while len(query) > 0:
+        node = start[query]
+        axis = axes[node]
+        near_left = points[query, axis] < coords[node, axis]
+        near = np.where(near_left, left[node], right[node])
+        near = np.where(near >= 0, near, np.where(near_left, right[node], left[node]))
+        deeper = (near >= 0) & (ends[np.maximum(near, 0)] - near >= target)
+        start[query[deeper]] = near[deeper]
+        query = query[deeper]
+    query, node = expand_ranges(np.arange(len(points)), start, ends[start])
+    weight = cum_counts[node + 1] - cum_counts[node]
+    best.push(query, ((coords[node] - points[query]) ** 2).sum(axis=1), node + offset, weight)
+
+    # Potem zwykłe przejście poziomami od korzenia: węzeł jest odrzucany, gdy
+    # jego komórka leży dalej niż bieżący k-ty sąsiad. Poddrzewo z pierwszej
+    # fazy już jest w kopcu, więc jest pomijane w całości.
+    node = np.zeros(len(points), dtype=np.intp)
+    query = np.arange(len(points))
+    cell = np.tile(bbox, (len(node), 1))
+    while len(node) > 0:
+        x = points[query]
+        gap = np.maximum(np.maximum(cell[:, :2] - x, x - cell[:, 2:]), 0)
+        bound = best.bound()[query]
+        keep = ((gap ** 2).sum(axis=1) <= bound) & (node != start[query])
+        node, query, cell, x, bound = node[keep], query[keep], cell[keep], x[keep], bound[keep]
+
+        rows, pos = kd_points(np.arange(len(node)), node, left, right, ends)
+        dist = ((coords[pos] - x[rows]) ** 2).sum(axis=1)
+        close = dist <= bound[rows]
+        pos = pos[close]
+        best.push(query[rows[close]], dist[close], pos + offset, cum_counts[pos + 1] - cum_counts[pos])
+
+        axis = axes[node]
+        split = coords[node, axis]
+        l, r = left[node], right[node]
+        go_left, go_right = l >= 0, r >= 0
+        left_cell, right_cell = cell[go_left], cell[go_right]
+        left_cell[np.arange(len(left_cell)), axis[go_left] + 2] = split[go_left]
+        right_cell[np.arange(len(right_cell)), axis[go_right]] = split[go_right]
+        node = np.concatenate([l[go_left], r[go_right]])
+        query = np.concatenate([query[go_left], query[go_right]])
+        cell = np.concatenate([left_cell, right_cell])
@@ -1,11 +1,14 @@
 from testmanager import *
 from src.kdtree import *
 from src.Quadtree import *
+from src.rangetree import *
+from src.morton import *
 from src.rectangle import *
+from src.dynamic import DynamicTree
+from src.polygon import Polygon
 from typing import List, Tuple, Optional
 import inspect
 import sys
-import timeit
 
 all_tests = []
 module = sys.modules[__name__]
@@ -43,41 +46,81 @@ def check_if_equal(l1: List["Node"], l2: List[Tuple[Tuple[float, float], int]],
     
     return True
 
+def brut_count(points: np.ndarray, rectangle: Rectangle) -> int:
+    (xmin, xmax), (ymin, ymax) = rectangle.extreme
+    return int(np.count_nonzero(
+        (points[:, 0] >= xmin) & (points[:, 0] <= xmax) & (points[:, 1] >= ymin) & (points[:, 1] <= ymax)
+    ))
+
+def check_queries(tree: DynamicTree, points: np.ndarray, rect: Rectangle) -> bool:
+    # Koło i romb wpisane w prostokąt testu; wyniki jako numery wierszy
+    # wejścia, razem z duplikatami.
+    (xmin, xmax), (ymin, ymax) = rect.extreme
+    center = ((xmin + xmax) / 2, (ymin + ymax) / 2)
+    radius = (xmax - xmin) / 2
+    expected = np.flatnonzero(((points - center) ** 2).sum(axis=1) <= radius ** 2)
+    if not np.array_equal(np.sort(tree.search_radius_rows(center, radius)), expected):
+        return False
+    if tree.count_radius(center, radius) != len(expected):
+        return False
+
+    vertices = np.array([[xmin, center[1]], [center[0], ymin], [xmax, center[1]], [center[0], ymax]])
+    expected = np.flatnonzero(Polygon(vertices).contains(points))
+    if not np.array_equal(np.sort(tree.search_polygon_rows(vertices)), expected):
+        return False
+    return tree.count_polygon(vertices) == len(expected)
+
+def check_nearest(tree: KdTree, points: np.ndarray, rect: Rectangle, k: int = 5) -> bool:
+    (xmin, xmax), (ymin, ymax) = rect.extreme
+    queries = np.array([[xmin, ymin], [xmax, ymax], [(xmin + xmax) / 2, (ymin + ymax) / 2]], dtype=np.float64)
+    expected = np.sort(np.sqrt(((points[None] - queries[:, None]) ** 2).sum(axis=2)), axis=1)[:, :k]
+    distances, indices = tree.nearest_many(queries, k)
+    if not np.allclose(distances, expected, rtol=0, atol=1e-9):
+        return False
+    return np.allclose(np.sqrt(((points[indices] - queries[:, None]) ** 2).sum(axis=2)), distances, rtol=0, atol=1e-9)
+
+def check_round_trip(tree: DynamicTree, points: np.ndarray, rect: Rectangle) -> bool:
+    # Usunięcie co dziesiątego wiersza i ponowne wstawienie: liczniki i
+    # wiersze wyników muszą zgadzać się z przeglądem zupełnym.
+    removed = points[::10]
+    tree.delete(removed)
+    if tree.count_rectangle(rect) != brut_count(np.delete(points, np.s_[::10], axis=0), rect):
+        return False
+    tree.insert(removed)
+    rows = tree.search_rectangle_rows(rect)
+    found = np.unique(tree.points[rows], axis=0, return_counts=True)
+    expected = np.unique(points[[rect.contains(p) for p in points.tolist()]], axis=0, return_counts=True)
+    return (tree.count_rectangle(rect) == len(rows) == brut_count(points, rect)
+            and all(np.array_equal(a, b) for a, b in zip(found, expected)))
+
 def test_methods():
-    with open("times.csv", "w") as f:
-        f.write("test_func,size,kd_time,quad_time,kd_query_time,quad_query_time\n")
+    # Pomiary czasu i pamięci wykonuje benchmark.py; tutaj tylko poprawność.
     for test_func, params in all_tests:
         for size in [1000, 5000, 10000, 20000, 40000, 60000, 80000, 100000]:
             print(f"Running {test_func.__name__} with n = {size}...")
             points, rect = test_func(size, **params)
-            
-            reps = 5
-            kd_time = timeit.timeit(lambda: KdTree(points), number=reps)/reps
+
             kd = KdTree(points)
-            quad_time = timeit.timeit(lambda: QuadTree(points), number=reps)/reps
             quad = QuadTree(points)
-            kd_query_time = timeit.timeit(lambda: list(kd.search_rectangle(rect)), number=reps)/reps
+            ranges = RangeTree(points)
+            linear = LinearQuadTree(points)
             result_kd = list(kd.search_rectangle(rect))
-            quad_query_time = timeit.timeit(lambda: list(quad.search_rectangle_with_count(rect)), number=reps)/reps
             result_quad = list(quad.search_rectangle_with_count(rect))
+            result_range = list(ranges.search_rectangle_with_count(rect))
+            result_linear = list(linear.search_rectangle_with_count(rect))
             result_brut = brut(points, rect)
 
-            if check_if_equal(result_kd, result_quad, result_brut):
+            if (check_if_equal(result_kd, result_quad, result_brut)
+                    and check_if_equal(result_kd, result_range, result_brut)
+                    and check_if_equal(result_kd, result_linear, result_brut)
+                    and check_queries(kd, points, rect) and check_queries(quad, points, rect)
+                    and check_nearest(kd, points, rect)
+                    and check_round_trip(kd, points, rect) and check_round_trip(quad, points, rect)):
                 print(f"\033[92m\u2714 {test_func.__name__} passed.\033[0m")
             else:
                 print(f"\033[91m\u2718 {test_func.__name__} failed.\033[0m")
-                print(len(result_kd), len(result_quad), len(result_brut))
-
-            print(f"Build Times (averaged over {reps} runs):")
-            print(f"  KdTree = {kd_time:.6f}s per run")
-            print(f"  QuadTree = {quad_time:.6f}s per run")
-            print(f"Query Times (averaged over {reps} runs):")
-            print(f"  KdTree = {kd_query_time:.6f}s per run")
-            print(f"  QuadTree = {quad_query_time:.6f}s per run")
+                print(len(result_kd), len(result_quad), len(result_range), len(result_linear), len(result_brut))
             print("-" * 60)
 
-            with open("times.csv", "a") as f:
-                f.write(f"{test_func.__name__},{size},{kd_time},{quad_time},{kd_query_time},{quad_query_time}\n")
-
 if __name__ == "__main__":
     test_methods()
\ No newline at end of file
@@ -1,47 +1,46 @@
 import numpy as np
+from typing import Iterator, Union
 from src.rectangle import Rectangle
 import matplotlib.pyplot as plt
 
-def random_uniform_test(count: int, minval: float = -100, maxval: float = 100, dimension: int = 2):
-    points = np.random.uniform(minval, maxval, (count, dimension))
+Seed = Union[int, np.random.Generator, None]
+
+# Każdy generator przyjmuje seed (liczbę albo gotowy np.random.Generator),
+# więc ten sam seed daje te same punkty niezależnie od globalnego stanu
+# np.random. Punkty są tworzone jedną operacją na tablicach - miliony punktów
+# powstają w czasie porównywalnym z jednym przebiegiem po danych.
+
+def random_uniform_test(count: int, minval: float = -100, maxval: float = 100, dimension: int = 2, seed: Seed = None):
+    points = np.random.default_rng(seed).uniform(minval, maxval, (count, dimension))
     rect = Rectangle(0.3*maxval, 0.3*maxval, minval + (maxval - minval) * 0.7, minval + (maxval - minval) * 0.7)
     return points, rect
 
-def random_normal_test(count: int, mean: float = 0, std: float = 1, dimension: int = 2):
-    points = np.random.normal(mean, std, (count, dimension))
+def random_normal_test(count: int, mean: float = 0, std: float = 1, dimension: int = 2, seed: Seed = None):
+    points = np.random.default_rng(seed).normal(mean, std, (count, dimension))
     minval = mean - std
     maxval = mean + std
     rect = Rectangle(minval, minval, 0.8*minval + (maxval - minval), 0.8*minval + (maxval - minval))
     return points, rect
 
-def random_integer_test(count: int, low: int = 0, high: int = 100, dimension: int = 2):
-    points = np.random.randint(low, high, (count, dimension))
+def random_integer_test(count: int, low: int = 0, high: int = 100, dimension: int = 2, seed: Seed = None):
+    points = np.random.default_rng(seed).integers(low, high, (count, dimension))
     rect = Rectangle(0.2*high, low, 0.9 * high, 0.9 * high)
     return points, rect
 
-def grid_test(count: int, minval: float = -100, maxval: float = 100, dimension: int = 2):
-    points = np.array(
-        [
-            [x, y]
-            for x in np.linspace(minval, maxval, int(np.sqrt(count)))
-            for y in np.linspace(minval, maxval, int(np.sqrt(count)))
-        ]
-    )
+def grid_test(count: int, minval: float = -100, maxval: float = 100, dimension: int = 2, seed: Seed = None):
+    axis = np.linspace(minval, maxval, int(np.sqrt(count)))
+    x, y = np.meshgrid(axis, axis, indexing="ij")
+    points = np.column_stack([x.ravel(), y.ravel()])
     rect = Rectangle(minval, minval, minval + (maxval - minval) * 0.5, minval + (maxval - minval) * 0.5)
     return points, rect
 
-def circle_test(count: int, radius: float = 1, dimension: int = 2):
-    points = []
-    for i in range(count):
-        angle = 2 * np.pi * i / count
-        x = radius * np.cos(angle)
-        y = radius * np.sin(angle)
-        points.append([x, y])
-    points = np.array(points)
+def circle_test(count: int, radius: float = 1, dimension: int = 2, seed: Seed = None):
+    angle = 2 * np.pi * np.arange(count) / count
+    points = np.column_stack([radius * np.cos(angle), radius * np.sin(angle)])
     rect = Rectangle(-radius * 0.5, -radius, radius * 0.5, radius)
     return points, rect
 
-def line_test(count: int, x1: float = -50, y1: float = -50, x2: float = 50, y2: float = 50):
+def line_test(count: int, x1: float = -50, y1: float = -50, x2: float = 50, y2: float = 50, seed: Seed = None):
     points = np.linspace([x1, y1], [x2, y2], count)
     rect = Rectangle(
         min(x1, x2), min(y1, y2), 
@@ -50,93 +49,83 @@ def line_test(count: int, x1: float = -50, y1: float = -50, x2: float = 50, y2:
     )
     return points, rect
 
-def cross_test(count: int, minval: float = -100, maxval: float = 100, dimension: int = 2):
-    points = []
-    for i in range(count // 2):
-        x = np.random.uniform(minval, maxval)
-        y = 0
-        points.append([x, y])
-        x = 0
-        y = np.random.uniform(minval, maxval)
-        points.append([x, y])
-    points = np.array(points)
+def cross_test(count: int, minval: float = -100, maxval: float = 100, dimension: int = 2, seed: Seed = None):
+    rng = np.random.default_rng(seed)
+    half = count // 2
+    points = np.zeros((2 * half, 2))
+    points[0::2, 0] = rng.uniform(minval, maxval, half)
+    points[1::2, 1] = rng.uniform(minval, maxval, half)
     rect = Rectangle(-maxval * 0.5, -maxval * 0.5, maxval * 0.5, maxval * 0.5)
     return points, rect
 
-def rectangle_sides_test(count: int, minval: float = -100, maxval: float = 100, dimension: int = 2):
-    points = []
-    for i in range(count // 4):
-        x = np.random.uniform(minval, maxval)
-        y = minval
-        points.append([x, y])
-        y = maxval
-        points.append([x, y])
-        y = np.random.uniform(minval, maxval)
-        x = minval
-        points.append([x, y])
-        x = maxval
-        points.append([x, y])
-    points = np.array(points)
+def rectangle_sides_test(count: int, minval: float = -100, maxval: float = 100, dimension: int = 2, seed: Seed = None):
+    rng = np.random.default_rng(seed)
+    quarter = count // 4
+    along = rng.uniform(minval, maxval, (2, quarter))
+    points = np.empty((4 * quarter, 2))
+    points[0::4] = np.column_stack([along[0], np.full(quarter, minval)])
+    points[1::4] = np.column_stack([along[0], np.full(quarter, maxval)])
+    points[2::4] = np.column_stack([np.full(quarter, minval), along[1]])
+    points[3::4] = np.column_stack([np.full(quarter, maxval), along[1]])
     rect = Rectangle(minval, minval, maxval * 0.5, maxval * 0.5)
     return points, rect
 
-def rectangle_with_diagonals_test(count: int, a: float = 50, b: float = 50, dimension: int = 2, on_diagonal_ratio: float = 0.5):
+def rectangle_with_diagonals_test(count: int, a: float = 50, b: float = 50, dimension: int = 2, on_diagonal_ratio: float = 0.5, seed: Seed = None):
+    rng = np.random.default_rng(seed)
     diag_count = int(count * on_diagonal_ratio)
     side_count = count - diag_count
 
-    diag_points = []
-    for i in range(diag_count):
-        if i % 2 == 0:
-            x = np.random.uniform(0, a)
-            y = (b / a) * x
-        else:
-            x = np.random.uniform(0, a)
-            y = b - (b / a) * x
-        diag_points.append([x, y])
-
-    side_points = []
-    for i in range(side_count):
-        side = i % 4
-        if side == 0:
-            x = np.random.uniform(0, a)
-            y = 0
-        elif side == 1:
-            x = np.random.uniform(0, a)
-            y = b
-        elif side == 2:
-            x = 0
-            y = np.random.uniform(0, b)
-        elif side == 3:
-            x = a
-            y = np.random.uniform(0, b)
-        side_points.append([x, y])
-
-    points = np.array(diag_points + side_points)
+    x = rng.uniform(0, a, diag_count)
+    rising = np.arange(diag_count) % 2 == 0
+    diag_points = np.column_stack([x, np.where(rising, (b / a) * x, b - (b / a) * x)])
+
+    side = np.arange(side_count) % 4
+    t = rng.uniform(0, 1, side_count)
+    side_points = np.column_stack([
+        np.select([side < 2, side == 2], [t * a, 0], a),
+        np.select([side == 0, side == 1], [0, b], t * b),
+    ])
+
+    points = np.concatenate([diag_points, side_points])
     rect = Rectangle(0, 0.1*b, 0.7*a, 0.7*b)
     return points, rect
 
-def test_two_clusters(count: int, minval: float = -100, maxval: float = 100, dimension: int = 2):
-    points = []
-    for i in range(count // 2):
-        x = np.random.uniform(minval, minval * 0.5)
-        y = np.random.uniform(minval, minval * 0.5)
-        points.append([x, y])
-        x = np.random.uniform(maxval * 0.5, maxval)
-        y = np.random.uniform(maxval * 0.5, maxval)
-        points.append([x, y])
-    points = np.array(points)
+def test_two_clusters(count: int, minval: float = -100, maxval: float = 100, dimension: int = 2, seed: Seed = None):
+    rng = np.random.default_rng(seed)
+    half = count // 2
+    points = np.empty((2 * half, 2))
+    points[0::2] = rng.uniform(minval, minval * 0.5, (half, 2))
+    points[1::2] = rng.uniform(maxval * 0.5, maxval, (half, 2))
     rect = Rectangle(minval * 0.7, minval * 0.7, maxval * 0.7, maxval * 0.7)
     return points, rect
 
-def test_with_outliers(count: int, minval: float = -100, maxval: float = 100, dimension: int = 2):
-    points = np.random.uniform(minval, maxval, (count, dimension))
-    for i in range(count // 10):
-        x = np.random.uniform(minval * 2, maxval * 2)
-        y = np.random.uniform(minval * 2, maxval * 2)
-        points = np.append(points, [[x, y]], axis=0)
+def test_with_outliers(count: int, minval: float = -100, maxval: float = 100, dimension: int = 2, seed: Seed = None):
+    rng = np.random.default_rng(seed)
+    points = np.concatenate([
+        rng.uniform(minval, maxval, (count, dimension)),
+        rng.uniform(minval * 2, maxval * 2, (count // 10, dimension)),
+    ])
     rect = Rectangle(minval, minval, maxval * 0.5, maxval * 0.5)
     return points, rect
 
+def random_rectangles(points: np.ndarray, count: int, selectivity: float = 0.01, seed: Seed = None) -> np.ndarray:
+    # Prostokąty zapytań (m, 4) o polu równym ułamkowi selectivity pola
+    # obwiedni punktów, położone losowo wewnątrz niej.
+    rng = np.random.default_rng(seed)
+    low, high = points.min(axis=0), points.max(axis=0)
+    extent = (high - low) * np.sqrt(selectivity)
+    lower = low + rng.random((count, 2)) * (high - low - extent)
+    return np.hstack([lower, lower + extent])
+
+def rectangle_stream(
+    points: np.ndarray, count: int, batch_size: int = 10000, selectivity: float = 0.01, seed: Seed = None
+) -> Iterator[np.ndarray]:
+    # Długi strumień zapytań generowany partiami - cały nie musi mieścić się
+    # w pamięci, a kolejne partie zależą tylko od seed.
+    rng = np.random.default_rng(seed)
+    for start in range(0, count, batch_size):
+        yield random_rectangles(points, min(batch_size, count - start), selectivity, rng)
+
 
 # def main():
 #     points, rect = rectangle_with_diagonals_test(1000)